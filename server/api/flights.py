@@ -1,30 +1,53 @@
 # api/flights.py
+import asyncio
 import os
 import re
-import json
+import logging
 import math
-import requests
+import threading
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
+from api.serpapi_client import ASYNC_SEMAPHORE, RETRY, SERPAPI_SEARCH_URL, SESSION, get_async_client
+
+log = logging.getLogger(__name__)
+
+load_dotenv()
+_SERPAPI_KEY = os.getenv("SERPAPI_API_KEY")
+
 def _get_serpapi_key() -> str:
-    load_dotenv()
-    key = os.getenv("SERPAPI_API_KEY")
+    key = _SERPAPI_KEY
     if not key:
-        print("[flights] ERROR: SERPAPI_API_KEY is missing")
+        log.error("SERPAPI_API_KEY is missing")
         raise RuntimeError("Missing SERPAPI_API_KEY")
     return key
 
-SERPAPI_SEARCH_URL = "https://serpapi.com/search.json"
-
 # --- Regexes ---------------------------------------------------------------
 IATA_RE = re.compile(r"\b([A-Z]{3})\b")
 DATE_RANGE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|-|–|—)\s*(\d{4}-\d{2}-\d{2})")
-PAX_RE = re.compile(r"(\d+)\s*(?:pax|guests?|traveler|travelers)\b", re.I)
-CLASS_RE = re.compile(r"\b(economy|premium economy|business|first)\b", re.I)
-NONSTOP_RE = re.compile(r"\b(non[-\s]?stop|direct only)\b", re.I)
-STOPS_RE = re.compile(r"\b(\d)\s*stop(s)?\b", re.I)
-ARROW_SPLIT_RE = re.compile(r"\b([A-Z]{3})\s*(?:->|to|—|–)\s*([A-Z]{3})\b")
+TRAILING_DETAILS_RE = re.compile(r"\d+.*$")  # dates/pax after a city name
+STATE_CODE_RE = re.compile(r"\b[A-Z]{2}\b")
+# Single-pass scanner for the per-field hint tokens (pax, class, nonstop, stops,
+# price cap). Each alternative is a lookahead so fields that overlap in the text
+# (e.g. "max 2 stops") are all still seen; keep the first hit per group.
+HINT_FIELDS_RE = re.compile(
+    r"(?=(?P<pax>\d+)\s*(?:pax|guests?|traveler|travelers)\b)"
+    r"|(?=\b(?P<tclass>premium economy|economy|business|first)\b)"
+    r"|(?=\b(?P<nonstop>non[-\s]?stop|direct only)\b)"
+    r"|(?=\b(?P<stops>\d)\s*stop(?:s)?\b)"
+    r"|(?=(?:<=|<=?\s*|\bmax\b|\$)\s*\$?\s*(?P<price>[0-9][0-9,]*))",
+    re.I,
+)
+HINT_FIELD_NAMES = frozenset(HINT_FIELDS_RE.groupindex)
+# SerpAPI error messages worth retrying; one case-insensitive scan per error
+TRANSIENT_ERROR_TOKENS = ("try again later", "temporary", "rate limit", "timeout", "timed out")
+TRANSIENT_ERROR_RE = re.compile("|".join(map(re.escape, TRANSIENT_ERROR_TOKENS)), re.I)
+ARROW_SEP_RE = re.compile(r"\s*(?:->|to|—|–)\s*")  # between two IATA codes
 
 TRAVEL_CLASS_MAP = {
     "economy": 1,
@@ -33,6 +56,10 @@ TRAVEL_CLASS_MAP = {
     "first": 4,
 }
 
+# "<n> stop(s)" digit -> SerpAPI stops filter
+# 0=any; 1=nonstop; 2=<=1 stop; 3=<=2 stops
+STOPS_FILTER = {str(n): 1 if n == 0 else min(3, n + 1) for n in range(10)}
+
 # Common IATA codes for major cities
 COMMON_IATA_CODES = {
     "toronto": "YYZ", "toronto canada": "YYZ", "toronto ontario": "YYZ",
@@ -74,101 +101,165 @@ COMMON_IATA_CODES = {
     "cork": "ORK", "cork ireland": "ORK"
 }
 
-def _coalesce(*vals):
-    for v in vals:
-        if v is not None:
-            return v
+def _is_iata(s: str) -> bool:
+    """Same test as IATA_RE.fullmatch, without the regex engine."""
+    return len(s) == 3 and s.isascii() and s.isalpha() and s.isupper()
+
+def _normalize_city(text: str) -> str:
+    return " ".join(text.lower().replace(",", " ").split())
+
+# Normalized alias -> IATA, built once at import
+_IATA_ALIAS: Dict[str, str] = {_normalize_city(k): v for k, v in COMMON_IATA_CODES.items()}
+
+# Country of each COMMON_IATA_CODES airport, so a trailing region qualifier is only
+# dropped when it names that same country ("Miami FL" yes; "Athens GA" and
+# "London ON" are other cities and go to the SerpAPI resolver instead)
+_IATA_COUNTRY = {
+    "YYZ": "CA",
+    "JFK": "US", "MIA": "US", "LAX": "US", "ORD": "US", "SFO": "US",
+    "LHR": "GB", "EDI": "GB", "GLA": "GB", "MAN": "GB", "BHX": "GB", "BRS": "GB", "NCL": "GB", "BFS": "GB",
+    "DUB": "IE", "ORK": "IE",
+    "ATH": "GR", "CDG": "FR", "MAD": "ES", "BCN": "ES", "FCO": "IT", "MXP": "IT",
+    "BER": "DE", "MUC": "DE", "AMS": "NL", "VIE": "AT", "PRG": "CZ", "BUD": "HU",
+    "WAW": "PL", "ARN": "SE", "OSL": "NO", "CPH": "DK", "HEL": "FI",
+    "NRT": "JP", "PEK": "CN", "SYD": "AU", "BOM": "IN",
+}
+
+_US_STATES = {
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas", "ca": "california",
+    "co": "colorado", "ct": "connecticut", "de": "delaware", "dc": "district of columbia",
+    "fl": "florida", "ga": "georgia", "hi": "hawaii", "id": "idaho", "il": "illinois",
+    "in": "indiana", "ia": "iowa", "ks": "kansas", "ky": "kentucky", "la": "louisiana",
+    "me": "maine", "md": "maryland", "ma": "massachusetts", "mi": "michigan", "mn": "minnesota",
+    "ms": "mississippi", "mo": "missouri", "mt": "montana", "ne": "nebraska", "nv": "nevada",
+    "nh": "new hampshire", "nj": "new jersey", "nm": "new mexico", "ny": "new york",
+    "nc": "north carolina", "nd": "north dakota", "oh": "ohio", "ok": "oklahoma", "or": "oregon",
+    "pa": "pennsylvania", "ri": "rhode island", "sc": "south carolina", "sd": "south dakota",
+    "tn": "tennessee", "tx": "texas", "ut": "utah", "vt": "vermont", "va": "virginia",
+    "wa": "washington", "wv": "west virginia", "wi": "wisconsin", "wy": "wyoming",
+}
+_CA_PROVINCES = {
+    "on": "ontario", "qc": "quebec", "bc": "british columbia", "ab": "alberta", "mb": "manitoba",
+    "sk": "saskatchewan", "ns": "nova scotia", "nb": "new brunswick", "nl": "newfoundland",
+    "pe": "prince edward island", "yt": "yukon", "nt": "northwest territories", "nu": "nunavut",
+}
+
+# Suffixes that may follow a known city without changing which city it is.
+# Two-letter ISO codes other than us/uk/gb are left out: most collide with US states.
+_REGION_SUFFIXES: Dict[str, frozenset] = {
+    "US": frozenset({"us", "usa", "united states", "united states of america", "america",
+                     *_US_STATES, *_US_STATES.values()}),
+    "CA": frozenset({"canada", *_CA_PROVINCES, *_CA_PROVINCES.values()}),
+    "GB": frozenset({"uk", "gb", "united kingdom", "great britain", "britain",
+                     "england", "scotland", "wales", "northern ireland"}),
+    "IE": frozenset({"ireland", "republic of ireland"}),
+    "GR": frozenset({"greece"}), "FR": frozenset({"france"}), "ES": frozenset({"spain"}),
+    "IT": frozenset({"italy"}), "DE": frozenset({"germany"}),
+    "NL": frozenset({"netherlands", "the netherlands", "holland"}),
+    "AT": frozenset({"austria"}), "CZ": frozenset({"czech republic", "czechia"}),
+    "HU": frozenset({"hungary"}), "PL": frozenset({"poland"}), "SE": frozenset({"sweden"}),
+    "NO": frozenset({"norway"}), "DK": frozenset({"denmark"}), "FI": frozenset({"finland"}),
+    "JP": frozenset({"japan"}), "CN": frozenset({"china"}), "IN": frozenset({"india"}),
+    "AU": frozenset({"australia", "nsw", "new south wales"}),
+}
+_MAX_SUFFIX_WORDS = max(len(s.split()) for v in _REGION_SUFFIXES.values() for s in v)
+
+def _is_region_suffix(words: List[str], country: str) -> bool:
+    """True if words split entirely into region qualifiers of the given country."""
+    allowed = _REGION_SUFFIXES.get(country, frozenset())
+    i = 0
+    while i < len(words):
+        for j in range(min(len(words), i + _MAX_SUFFIX_WORDS), i, -1):
+            if " ".join(words[i:j]) in allowed:
+                i = j
+                break
+        else:
+            return False
+    return True
+
+def _lookup_iata_alias(text: str) -> Optional[str]:
+    """
+    Longest known city prefix whose remaining words are all qualifiers of that
+    city's own country ("miami fl usa" -> MIA). Anything else is None, so the
+    caller falls through to the SerpAPI resolver.
+    """
+    words = _normalize_city(text).split(" ")
+    for end in range(len(words), 0, -1):
+        code = _IATA_ALIAS.get(" ".join(words[:end]))
+        if code:
+            return code if _is_region_suffix(words[end:], _IATA_COUNTRY.get(code, "")) else None
     return None
 
+def _before_details(part: str) -> str:
+    m = TRAILING_DETAILS_RE.search(part)
+    return (part[:m.start()] if m else part).strip()
+
 def parse_flight_hint(hint: str) -> Dict[str, Any]:
     """
     Parse a compact LLM hint like:
       "YYZ->ATH 2025-08-26 to 2025-09-01 2 pax economy nonstop <= $1250"
     Returns structured params for SerpAPI.
     """
-    print(f"[flights] parse_flight_hint: raw hint: {hint!r}")
+    log.debug("parse_flight_hint: raw hint: %r", hint)
     hint = (hint or "").strip()
     if not hint:
         raise ValueError("Empty flight hint")
 
-    # 1) origin & destination (prefer explicit IATA arrow pattern)
-    od = ARROW_SPLIT_RE.search(hint)
-    origin, dest = (od.group(1), od.group(2)) if od else (None, None)
-
-    # Fallback: first two IATA codes anywhere
-    if not (origin and dest):
-        codes = IATA_RE.findall(hint)
+    # 1) origin & destination from one pass over the IATA codes: prefer the
+    # first adjacent pair joined by an arrow, else the first two codes anywhere
+    origin, dest = None, None
+    codes = list(IATA_RE.finditer(hint))
+    for a, b in zip(codes, codes[1:]):
+        if ARROW_SEP_RE.fullmatch(hint, a.end(), b.start()):
+            origin, dest = a.group(1), b.group(1)
+            break
+    else:
         if len(codes) >= 2:
-            origin, dest = codes[0], codes[1]
-    
+            origin, dest = codes[0].group(1), codes[1].group(1)
+
     # 2) If still no IATA codes, try to extract city names and convert them
     if not (origin and dest):
         # Look for city names in the format "City Country" or "City"
         # Split by arrow and extract the first two significant words/phrases
-        parts = hint.split('->')
-        if len(parts) >= 2:
-            # Extract origin (before arrow)
-            origin_part = parts[0].strip()
-            # Extract destination (after arrow)
-            dest_part = parts[1].strip()
-            
-            # Clean up and extract city names
-            origin_city = re.sub(r'\d+.*$', '', origin_part).strip()  # Remove dates and numbers
-            dest_city = re.sub(r'\d+.*$', '', dest_part).strip()  # Remove dates and numbers
+        origin_part, arrow, rest = hint.partition('->')
+        if arrow:
+            # Destination runs up to the next arrow, if any
+            dest_part = rest.partition('->')[0]
+
+            # Clean up and extract city names (cut at the first date/number)
+            origin_city = _before_details(origin_part)
+            dest_city = _before_details(dest_part)
             
-            print(f"[flights] Extracted city names: origin='{origin_city}', dest='{dest_city}'")
+            log.debug("Extracted city names: origin=%r, dest=%r", origin_city, dest_city)
             
-            # Try multiple variations of the city names
-            origin = _city_to_iata_best_effort(origin_city)
-            if not origin:
-                # Try without state/country codes
-                origin_clean = re.sub(r'\b[A-Z]{2}\b', '', origin_city).strip()
-                if origin_clean != origin_city:
-                    print(f"[flights] Trying cleaned origin: '{origin_clean}'")
-                    origin = _city_to_iata_best_effort(origin_clean)
-            
-            dest = _city_to_iata_best_effort(dest_city)
-            if not dest:
-                # Try without state/country codes
-                dest_clean = re.sub(r'\b[A-Z]{2}\b', '', dest_city).strip()
-                if dest_clean != dest_city:
-                    print(f"[flights] Trying cleaned destination: '{dest_clean}'")
-                    dest = _city_to_iata_best_effort(dest_clean)
-            
-            print(f"[flights] Converted to IATA: {origin_city} -> {origin}, {dest_city} -> {dest}")
+            # Try multiple variations of the city names (both sides concurrently)
+            origin, dest = _resolve_pair(origin_city, dest_city, resolve=_resolve_hint_city)
+
+            log.debug("Converted to IATA: %s -> %s, %s -> %s", origin_city, origin, dest_city, dest)
 
     # 3) dates (ISO only)
     dmatch = DATE_RANGE_RE.search(hint)
     outbound_date, return_date = (dmatch.group(1), dmatch.group(2)) if dmatch else (None, None)
 
-    # 4) pax
-    pax = 1
-    pm = PAX_RE.search(hint)
-    if pm:
-        pax = max(1, int(pm.group(1)))
-
-    # 5) class
-    tclass = 1  # default economy
-    cm = CLASS_RE.search(hint)
-    if cm:
-        tclass = TRAVEL_CLASS_MAP.get(cm.group(1).lower(), 1)
-
-    # 6) stops
-    # 0=any; 1=nonstop; 2=<=1 stop; 3=<=2 stops
-    stops = 0
-    if NONSTOP_RE.search(hint):
-        stops = 1
-    else:
-        sm = STOPS_RE.search(hint)
-        if sm:
-            n = int(sm.group(1))
-            stops = 1 if n == 0 else min(3, n + 1)
+    # 4-7) pax, class, stops and price cap in one scan
+    fields: Dict[str, str] = {}
+    for m in HINT_FIELDS_RE.finditer(hint):
+        name = m.lastgroup
+        if name not in fields:
+            fields[name] = m.group(name)
+            if len(fields) == len(HINT_FIELD_NAMES):
+                break
+
+    pax = max(1, int(fields["pax"])) if "pax" in fields else 1
+
+    # the tclass alternatives are exactly the TRAVEL_CLASS_MAP keys
+    tclass = TRAVEL_CLASS_MAP[fields["tclass"].casefold()] if "tclass" in fields else 1  # default economy
+
+    stops = 1 if "nonstop" in fields else STOPS_FILTER.get(fields.get("stops"), 0)
 
-    # 7) price cap
     max_price = None
-    mp = re.search(r"(?:<=|<=?\s*|\bmax\b|\$)\s*\$?\s*([0-9][0-9,]*)", hint, re.I)
-    if mp:
-        max_price = int(mp.group(1).replace(",", ""))
+    if "price" in fields:
+        max_price = int(fields["price"].replace(",", ""))
 
     parsed = {
         "origin": origin,
@@ -180,9 +271,68 @@ def parse_flight_hint(hint: str) -> Dict[str, Any]:
         "stops": stops,
         "max_price": max_price,
     }
-    print(f"[flights] parse_flight_hint: parsed: {json.dumps(parsed, indent=2)}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("parse_flight_hint: parsed: %s", orjson.dumps(parsed, option=orjson.OPT_INDENT_2).decode())
     return parsed
 
+@lru_cache(maxsize=4096)
+def _resolve_local(text: str) -> Optional[str]:
+    """IATA passthrough or local alias hit; pure, so safe to memoize."""
+    if _is_iata(text):
+        return text
+    return _lookup_iata_alias(text)
+
+# Airport codes are effectively immutable, so hits live for a month; misses
+# (often misspellings) only for an hour so a fixed typo isn't stuck unresolved.
+_REMOTE_HITS: TTLCache = TTLCache(maxsize=4096, ttl=30 * 24 * 3600)
+_REMOTE_MISSES: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+_REMOTE_LOCK = threading.Lock()
+
+def _resolve_remote(text: str) -> Optional[str]:
+    """
+    Cached SerpAPI resolver keyed by lower-cased text. Request errors propagate
+    and are not cached.
+    """
+    key = text.lower()
+    with _REMOTE_LOCK:
+        if key in _REMOTE_HITS:
+            return _REMOTE_HITS[key]
+        if key in _REMOTE_MISSES:
+            return None
+    code = _serpapi_airport_lookup(text)
+    with _REMOTE_LOCK:
+        if code:
+            _REMOTE_HITS[key] = code
+        else:
+            _REMOTE_MISSES[key] = True
+    return code
+
+def _serpapi_airport_lookup(text: str) -> Optional[str]:
+    """SerpAPI best-effort resolver (not guaranteed)."""
+    api_key = _get_serpapi_key()
+    resp = SESSION.get(
+        SERPAPI_SEARCH_URL,
+        params={
+            "engine": "google_flights",
+            "api_key": api_key,
+            "departure_id": text,
+            "arrival_id": text,
+            "output": "json",
+            "json_restrictor": "airports[].{departure[].airport.id,arrival[].airport.id}",
+        },
+        timeout=30,
+    )
+    data = orjson.loads(resp.content)
+    airports = data.get("airports", [])
+    for item in airports:
+        for side in ("departure", "arrival"):
+            arr = item.get(side, [])
+            if arr and "airport" in arr[0] and "id" in arr[0]["airport"]:
+                cand = arr[0]["airport"]["id"]
+                if _is_iata(cand):
+                    return cand
+    return None
+
 def _city_to_iata_best_effort(text: Optional[str]) -> Optional[str]:
     """
     If text is IATA, return as-is. Else try local map, then SerpAPI best-effort resolver.
@@ -190,59 +340,52 @@ def _city_to_iata_best_effort(text: Optional[str]) -> Optional[str]:
     if not text:
         return None
     text_stripped = text.strip()
-    print(f"[flights] _city_to_iata_best_effort: trying to resolve '{text_stripped}'")
-    
-    if IATA_RE.fullmatch(text_stripped):
-        print(f"[flights] _city_to_iata_best_effort: '{text_stripped}' is already IATA")
-        return text_stripped
-
-    # Try local quick map with multiple variations
-    key = text_stripped.lower()
-    if key in COMMON_IATA_CODES:
-        print(f"[flights] city->IATA (local): {text_stripped} -> {COMMON_IATA_CODES[key]}")
-        return COMMON_IATA_CODES[key]
-    
-    # Try without state/country codes
-    clean_key = re.sub(r'\b[A-Z]{2}\b', '', key).strip()
-    if clean_key != key and clean_key in COMMON_IATA_CODES:
-        print(f"[flights] city->IATA (local, cleaned): {text_stripped} -> {COMMON_IATA_CODES[clean_key]}")
-        return COMMON_IATA_CODES[clean_key]
+    log.debug("_city_to_iata_best_effort: trying to resolve %r", text_stripped)
+
+    code = _resolve_local(text_stripped)
+    if code:
+        log.debug("city->IATA (local): %s -> %s", text_stripped, code)
+        return code
 
     # SerpAPI best-effort (not guaranteed) - only for unknown cities
-    print(f"[flights] city->IATA (serpapi resolver): trying to resolve {text_stripped!r}")
+    log.debug("city->IATA (serpapi resolver): trying to resolve %r", text_stripped)
     try:
-        api_key = _get_serpapi_key()
-        resp = requests.get(
-            SERPAPI_SEARCH_URL,
-            params={
-                "engine": "google_flights",
-                "api_key": api_key,
-                "departure_id": text_stripped,
-                "arrival_id": text_stripped,
-                "output": "json",
-                "json_restrictor": "airports[].{departure[].airport.id,arrival[].airport.id}",
-            },
-            timeout=30,
-        )
-        data = resp.json()
-        airports = data.get("airports", [])
-        for item in airports:
-            for side in ("departure", "arrival"):
-                arr = item.get(side, [])
-                if arr and "airport" in arr[0] and "id" in arr[0]["airport"]:
-                    cand = arr[0]["airport"]["id"]
-                    if IATA_RE.fullmatch(cand):
-                        print(f"[flights] city->IATA (serpapi): {text_stripped} -> {cand}")
-                        return cand
+        code = _resolve_remote(text_stripped)
     except Exception as e:
-        print(f"[flights] resolver exception: {e}")
-    print(f"[flights] city->IATA: failed to resolve {text_stripped!r}")
+        log.warning("resolver exception: %s", e)
+        code = None
+    if code:
+        log.info("city->IATA (serpapi): %s -> %s", text_stripped, code)
+        return code
+    log.warning("city->IATA: failed to resolve %r", text_stripped)
     return None
 
-def serpapi_flights(params: Dict[str, Any], currency: str = "USD", gl: str = "ca", hl: str = "en") -> Dict[str, Any]:
+def _resolve_hint_city(city: str) -> Optional[str]:
+    code = _city_to_iata_best_effort(city)
+    if not code:
+        # Try without state/country codes
+        city_clean = STATE_CODE_RE.sub('', city).strip()
+        if city_clean != city:
+            log.debug("Trying cleaned city: %r", city_clean)
+            code = _city_to_iata_best_effort(city_clean)
+    return code
+
+_RESOLVER_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="iata-resolver")
+
+def _resolve_pair(a: str, b: str, resolve=_city_to_iata_best_effort) -> Tuple[Optional[str], Optional[str]]:
     """
-    Call SerpAPI Google Flights and return JSON with retry logic.
+    Resolve two places to IATA. Codes and local-map hits return immediately;
+    when both sides need SerpAPI the lookups run concurrently on _RESOLVER_POOL.
     """
+    local_a, local_b = _resolve_local(a.strip()), _resolve_local(b.strip())
+    if local_a or local_b:
+        return local_a or resolve(a), local_b or resolve(b)
+    fut_a = _RESOLVER_POOL.submit(resolve, a)
+    fut_b = _RESOLVER_POOL.submit(resolve, b)
+    return fut_a.result(), fut_b.result()
+
+def _build_flights_query(params: Dict[str, Any], currency: str, gl: str, hl: str) -> Dict[str, Any]:
+    """Validate parsed hint params, resolve IATA codes and build the SerpAPI query."""
     api_key = _get_serpapi_key()
 
     dep = params.get("origin")
@@ -256,9 +399,8 @@ def serpapi_flights(params: Dict[str, Any], currency: str = "USD", gl: str = "ca
     if not dep or not arr:
         raise ValueError(f"Missing origin/dest in params: {params}")
 
-    # Resolve non-IATA to IATA
-    dep_id = _city_to_iata_best_effort(dep)
-    arr_id = _city_to_iata_best_effort(arr)
+    # Resolve non-IATA to IATA (parse_flight_hint output is already IATA)
+    dep_id, arr_id = _resolve_pair(dep, arr)
     if not dep_id or not arr_id:
         raise ValueError(f"Could not resolve IATA codes: origin={dep!r}->{dep_id!r}, dest={arr!r}->{arr_id!r}")
 
@@ -283,77 +425,112 @@ def serpapi_flights(params: Dict[str, Any], currency: str = "USD", gl: str = "ca
     if params.get("max_price") is not None:
         q["max_price"] = params["max_price"]
 
-    print(f"[flights] serpapi_flights: request params: {json.dumps(q, indent=2)}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("serpapi_flights: request params: %s", orjson.dumps(q, option=orjson.OPT_INDENT_2).decode())
+    return q
+
+def _decode_serpapi_response(resp) -> Dict[str, Any]:
+    """Decode a requests/httpx response body; non-JSON bodies raise."""
+    try:
+        return orjson.loads(resp.content)
+    except ValueError:
+        log.error("Non-JSON response: status=%s, text=%s", resp.status_code, resp.text[:500])
+        resp.raise_for_status()
+        raise
+
+def _serpapi_retry_delay(data: Dict[str, Any], attempt: int, max_retries: int) -> Optional[float]:
+    """
+    None if the payload is a usable result, else the backoff before the next
+    attempt. Permanent errors, or transient ones on the last attempt, raise.
+    """
+    if not data.get("error"):
+        log.debug("serpapi_flights: got response keys: %s", list(data))
+        return None
+
+    error_msg = data['error']
+    log.warning("SerpAPI error (attempt %d/%d): %s", attempt + 1, max_retries, error_msg)
+
+    # If it's a temporary error, retry
+    if TRANSIENT_ERROR_RE.search(error_msg):
+        if attempt < max_retries - 1:
+            delay = RETRY.backoff_factor * (2 ** attempt)
+            log.info("Retrying in %.1f seconds...", delay)
+            return delay
+
+    # If it's a permanent error or we've exhausted retries
+    raise RuntimeError(f"SerpAPI error: {error_msg}")
+
+def serpapi_flights(params: Dict[str, Any], currency: str = "USD", gl: str = "ca", hl: str = "en") -> Dict[str, Any]:
+    """
+    Call SerpAPI Google Flights and return JSON with retry logic.
+    """
+    q = _build_flights_query(params, currency, gl, hl)
 
-    # Retry logic for SerpAPI
+    # Connection errors and 429/5xx are retried by the session adapter (RETRY);
+    # only SerpAPI's own "try again later" payloads, which urllib3 can't see,
+    # are retried here, on the same exponential backoff.
     max_retries = 3
     for attempt in range(max_retries):
-        try:
-            resp = requests.get(SERPAPI_SEARCH_URL, params=q, timeout=60)
-            data = resp.json()
-            
-            if data.get("error"):
-                error_msg = data['error']
-                print(f"[flights] SerpAPI ERROR (attempt {attempt + 1}/{max_retries}): {error_msg}")
-                
-                # If it's a temporary error, retry
-                if "try again later" in error_msg.lower() or "temporary" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        print(f"[flights] Retrying in 2 seconds...")
-                        import time
-                        time.sleep(2)
-                        continue
-                
-                # If it's a permanent error or we've exhausted retries
-                raise RuntimeError(f"SerpAPI error: {error_msg}")
-            
-            print(f"[flights] serpapi_flights: got response keys: {list(data.keys())}")
+        resp = SESSION.get(SERPAPI_SEARCH_URL, params=q, timeout=60)
+        data = _decode_serpapi_response(resp)
+        delay = _serpapi_retry_delay(data, attempt, max_retries)
+        if delay is None:
             return data
-            
-        except requests.exceptions.RequestException as e:
-            print(f"[flights] Request ERROR (attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                print(f"[flights] Retrying in 2 seconds...")
-                import time
-                time.sleep(2)
-                continue
-            raise
-        except Exception as e:
-            print(f"[flights] ERROR: Non-JSON response: status={resp.status_code}, text={resp.text[:500]}")
-            if attempt < max_retries - 1:
-                print(f"[flights] Retrying in 2 seconds...")
-                import time
-                time.sleep(2)
-                continue
-            resp.raise_for_status()
-            raise
+        time.sleep(delay)
 
     # This should never be reached, but just in case
     raise RuntimeError("SerpAPI request failed after all retries")
 
+async def serpapi_flights_async(params: Dict[str, Any], currency: str = "USD", gl: str = "ca", hl: str = "en") -> Dict[str, Any]:
+    """
+    Async serpapi_flights for fan-out callers (asyncio.gather over many hints).
+    """
+    # IATA resolution may hit SerpAPI through the sync session
+    q = await asyncio.to_thread(_build_flights_query, params, currency, gl, hl)
+    client = get_async_client()
+
+    # httpx only retries connection failures, so 429/5xx are backed off here too
+    max_retries = 3
+    for attempt in range(max_retries):
+        async with ASYNC_SEMAPHORE:
+            resp = await client.get(SERPAPI_SEARCH_URL, params=q)
+        if resp.status_code in RETRY.status_forcelist and attempt < max_retries - 1:
+            delay = RETRY.backoff_factor * (2 ** attempt)
+            log.info("SerpAPI HTTP %s, retrying in %.1f seconds...", resp.status_code, delay)
+            await asyncio.sleep(delay)
+            continue
+        data = _decode_serpapi_response(resp)
+        delay = _serpapi_retry_delay(data, attempt, max_retries)
+        if delay is None:
+            return data
+        await asyncio.sleep(delay)
+
+    raise RuntimeError("SerpAPI request failed after all retries")
+
+_EMPTY: Dict[str, Any] = {}  # shared read-only default for missing nested objects
+
 def _normalize_flight_item(item: Dict[str, Any], currency: str) -> Dict[str, Any]:
-    price = item.get("price")
-    total_duration = item.get("total_duration")
-    legs = []
-    for f in item.get("flights", []):
-        legs.append({
+    legs = [
+        {
             "airline": f.get("airline"),
             "flight_number": f.get("flight_number"),
             "travel_class": f.get("travel_class"),
             "departure": {
-                "airport_id": f.get("departure_airport", {}).get("id"),
-                "time": f.get("departure_airport", {}).get("time"),
+                "airport_id": (dep := f.get("departure_airport") or _EMPTY).get("id"),
+                "time": dep.get("time"),
             },
             "arrival": {
-                "airport_id": f.get("arrival_airport", {}).get("id"),
-                "time": f.get("arrival_airport", {}).get("time"),
+                "airport_id": (arr := f.get("arrival_airport") or _EMPTY).get("id"),
+                "time": arr.get("time"),
             },
             "duration_min": f.get("duration"),
-        })
+        }
+        for f in item.get("flights") or ()
+    ]
     return {
-        "price": price,
+        "price": item.get("price"),
         "currency": currency,
-        "total_duration_min": total_duration,
+        "total_duration_min": item.get("total_duration"),
         "stops_count": max(0, len(legs) - 1),
         "legs": legs,
         "departure_token": item.get("departure_token"),
@@ -362,33 +539,31 @@ def _normalize_flight_item(item: Dict[str, Any], currency: str) -> Dict[str, Any
 
 def pick_best_flight(data: Dict[str, Any], budget_cap: Optional[int] = None, nonstop_pref: Optional[bool] = None, currency: str = "USD") -> Optional[Dict[str, Any]]:
     candidates = (data.get("best_flights") or []) + (data.get("other_flights") or [])
-    print(f"[flights] pick_best_flight: candidates={len(candidates)} (best={len(data.get('best_flights') or [])}, other={len(data.get('other_flights') or [])})")
+    log.debug(
+        "pick_best_flight: candidates=%d (best=%d, other=%d)",
+        len(candidates), len(data.get("best_flights") or []), len(data.get("other_flights") or []),
+    )
     if not candidates:
         return None
 
-    norm = [_normalize_flight_item(c, currency) for c in candidates]
-
+    # Score raw SerpAPI items so only the winner gets normalized
     def score(x: Dict[str, Any]) -> Tuple:
         price = x.get("price") if isinstance(x.get("price"), int) else math.inf
-        dur = x.get("total_duration_min") or math.inf
-        stops_count = x.get("stops_count", 0)
+        dur = x.get("total_duration") or math.inf
+        stops_count = max(0, len(x.get("flights") or ()) - 1)
         in_budget = budget_cap is None or (isinstance(price, int) and price <= budget_cap)
         nonstop_bonus = -1 if nonstop_pref and stops_count == 0 else 0
         return (0 if in_budget else 1, price, dur, nonstop_bonus)
 
-    norm.sort(key=score)
-    print(f"[flights] pick_best_flight: best={json.dumps(norm[0], indent=2)[:800]}")
-    return norm[0]
+    best = _normalize_flight_item(min(candidates, key=score), currency)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(
+            "pick_best_flight: best price=%s duration=%s stops=%s",
+            best["price"], best["total_duration_min"], best["stops_count"],
+        )
+    return best
 
-def search_best_flight_from_hint(
-    hint: str,
-    *,
-    total_budget_usd: Optional[float] = None,
-    currency: str = "USD",
-    gl: str = "ca",
-    hl: str = "en",
-) -> Dict[str, Any]:
-    print(f"[flights] search_best_flight_from_hint: hint={hint!r}, total_budget_usd={total_budget_usd}")
+def _parse_hint_for_search(hint: str, total_budget_usd: Optional[float]) -> Dict[str, Any]:
     parsed = parse_flight_hint(hint)
 
     # Validate minimal parsed fields before network call
@@ -398,65 +573,103 @@ def search_best_flight_from_hint(
 
     if total_budget_usd and not parsed.get("max_price"):
         parsed["max_price"] = int(total_budget_usd / 4)
-        print(f"[flights] applying budget cap from total_budget_usd: max_price={parsed['max_price']}")
+        log.debug("applying budget cap from total_budget_usd: max_price=%s", parsed["max_price"])
+    return parsed
+
+def _flight_result(parsed: Dict[str, Any], data: Dict[str, Any], currency: str) -> Dict[str, Any]:
+    best = pick_best_flight(
+        data,
+        budget_cap=parsed.get("max_price"),
+        nonstop_pref=(parsed.get("stops") == 1),
+        currency=currency,
+    )
+
+    result = {
+        "query_used": parsed,
+        "best_flight": best,
+        "raw": {
+            "search_metadata": data.get("search_metadata"),
+            "price_insights": data.get("price_insights"),
+        },
+    }
+    log.debug("search_best_flight_from_hint: result keys: %s", list(result))
+    return result
+
+def _fallback_flight_result(parsed: Dict[str, Any], currency: str) -> Dict[str, Any]:
+    # Create a fallback flight structure
+    fallback_flight = {
+        "price": parsed.get("max_price", 800),
+        "currency": currency,
+        "total_duration_min": 480,  # 8 hours default
+        "stops_count": 1,
+        "legs": [
+            {
+                "airline": "Multiple Airlines",
+                "flight_number": "N/A",
+                "travel_class": "Economy",
+                "departure": {
+                    "airport_id": parsed.get("origin"),
+                    "time": f"{parsed.get('outbound_date')} 10:00",
+                },
+                "arrival": {
+                    "airport_id": parsed.get("dest"),
+                    "time": f"{parsed.get('outbound_date')} 18:00",
+                },
+                "duration_min": 480,
+            }
+        ],
+        "departure_token": None,
+        "booking_token": None,
+    }
+
+    result = {
+        "query_used": parsed,
+        "best_flight": fallback_flight,
+        "raw": {
+            "search_metadata": {"status": "fallback"},
+            "price_insights": None,
+        },
+        "fallback": True,
+    }
+    log.debug("search_best_flight_from_hint: fallback result created")
+    return result
+
+def search_best_flight_from_hint(
+    hint: str,
+    *,
+    total_budget_usd: Optional[float] = None,
+    currency: str = "USD",
+    gl: str = "ca",
+    hl: str = "en",
+) -> Dict[str, Any]:
+    log.info("search_best_flight_from_hint: hint=%r, total_budget_usd=%s", hint, total_budget_usd)
+    parsed = _parse_hint_for_search(hint, total_budget_usd)
 
     try:
         data = serpapi_flights(parsed, currency=currency, gl=gl, hl=hl)
-        best = pick_best_flight(
-            data,
-            budget_cap=parsed.get("max_price"),
-            nonstop_pref=(parsed.get("stops") == 1),
-            currency=currency,
-        )
-        
-        result = {
-            "query_used": parsed,
-            "best_flight": best,
-            "raw": {
-                "search_metadata": data.get("search_metadata"),
-                "price_insights": data.get("price_insights"),
-            },
-        }
-        print(f"[flights] search_best_flight_from_hint: result keys: {list(result.keys())}")
-        return result
-        
+        return _flight_result(parsed, data, currency)
     except Exception as e:
-        print(f"[flights] SerpAPI failed, creating fallback flight: {e}")
-        
-        # Create a fallback flight structure
-        fallback_flight = {
-            "price": parsed.get("max_price", 800),
-            "currency": currency,
-            "total_duration_min": 480,  # 8 hours default
-            "stops_count": 1,
-            "legs": [
-                {
-                    "airline": "Multiple Airlines",
-                    "flight_number": "N/A",
-                    "travel_class": "Economy",
-                    "departure": {
-                        "airport_id": parsed.get("origin"),
-                        "time": f"{parsed.get('outbound_date')} 10:00",
-                    },
-                    "arrival": {
-                        "airport_id": parsed.get("dest"),
-                        "time": f"{parsed.get('outbound_date')} 18:00",
-                    },
-                    "duration_min": 480,
-                }
-            ],
-            "departure_token": None,
-            "booking_token": None,
-        }
-        
-        result = {
-            "query_used": parsed,
-            "best_flight": fallback_flight,
-            "raw": {
-                "search_metadata": {"status": "fallback"},
-                "price_insights": None,
-            },
-            "fallback": True,
-        }
-        print(f"[flights] search_best_flight_from_hint: fallback result created")
-        return result
+        log.warning("SerpAPI failed, creating fallback flight: %s", e)
+        return _fallback_flight_result(parsed, currency)
+
+async def search_best_flight_from_hint_async(
+    hint: str,
+    *,
+    total_budget_usd: Optional[float] = None,
+    currency: str = "USD",
+    gl: str = "ca",
+    hl: str = "en",
+) -> Dict[str, Any]:
+    """
+    Async search_best_flight_from_hint; callers searching several hints can
+    asyncio.gather these so latency is the slowest search, not the sum.
+    """
+    log.info("search_best_flight_from_hint_async: hint=%r, total_budget_usd=%s", hint, total_budget_usd)
+    parsed = await asyncio.to_thread(_parse_hint_for_search, hint, total_budget_usd)
+
+    try:
+        data = await serpapi_flights_async(parsed, currency=currency, gl=gl, hl=hl)
+        return _flight_result(parsed, data, currency)
+    except Exception as e:
+        log.warning("SerpAPI failed, creating fallback flight: %s", e)
+        return _fallback_flight_result(parsed, currency)
@@ -1,11 +1,15 @@
 # api/lodging_serpapi.py
+import asyncio
 import os
 import re
 import math
-from datetime import datetime
+from datetime import date
+from functools import lru_cache
 from typing import Dict, Any, List, Optional, Tuple
 
-from serpapi import GoogleSearch  # pip install google-search-results
+import orjson
+
+from api.serpapi_client import ASYNC_SEMAPHORE, SERPAPI_SEARCH_URL, SESSION, cache_get, cache_key, cache_set, get_async_client
 
 # ---------- Regex helpers ----------
 DATE_RANGE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|-|–)\s*(\d{4}-\d{2}-\d{2})", re.I)
@@ -25,18 +29,26 @@ IATA_TO_CITY = {
     "JFK": "New York, NY", "LAX": "Los Angeles, CA", "SFO": "San Francisco, CA",
 }
 
+CUR_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP"}
+_NUM_STRIP = str.maketrans("", "", ",$€£")  # thousands separators + currency symbols
+
 def _parse_currency(s: str) -> str:
     m = CUR_SYM_RE.search(s or "")
     if not m: return "USD"
     tok = m.group(0).upper()
-    return {"$": "USD", "€": "EUR", "£": "GBP"}.get(tok, tok)
+    return CUR_SYMBOLS.get(tok, tok)
 
 def _num(s: str) -> Optional[float]:
     try:
-        return float(s.replace(",", "").replace("$", "").replace("€", "").replace("£", "").strip())
+        return float(s.translate(_NUM_STRIP).strip())
     except Exception:
         return None
 
+@lru_cache(maxsize=1024)
+def _nights(check_in: str, check_out: str) -> int:
+    # Same date pairs recur across trips/batches; date.fromisoformat is the C fast path
+    return (date.fromisoformat(check_out) - date.fromisoformat(check_in)).days
+
 def _parse_lodging_hint(hint: str) -> Tuple[str, str, str, int, Optional[float], str, int, str]:
     """
     Returns: (city_code, check_in, check_out, adults, total_budget, currency, nights, q_location)
@@ -54,11 +66,9 @@ def _parse_lodging_hint(hint: str) -> Tuple[str, str, str, int, Optional[float],
         raise ValueError("No date range like 'YYYY-MM-DD to YYYY-MM-DD' found in lodging hint.")
     check_in, check_out = m_dates.group(1), m_dates.group(2)
     try:
-        dt_in = datetime.fromisoformat(check_in)
-        dt_out = datetime.fromisoformat(check_out)
+        nights = _nights(check_in, check_out)
     except Exception:
         raise ValueError("Invalid ISO dates in lodging hint.")
-    nights = (dt_out - dt_in).days
     if nights <= 0:
         raise ValueError("Check-out must be after check-in.")
 
@@ -71,14 +81,42 @@ def _parse_lodging_hint(hint: str) -> Tuple[str, str, str, int, Optional[float],
     if near_total:
         total_budget = _num(near_total.group(1))
     else:
-        # last numeric token that's not a date fragment
-        candidates = [m.group(1) for m in ANY_MONEY_RE.finditer(s)]
-        candidates = [c for c in candidates if "-" not in c]
-        if candidates:
-            total_budget = _num(candidates[-1])
+        # last numeric token (ANY_MONEY_RE never spans a "-", so date
+        # fragments come through split into plain numbers)
+        last = None
+        for last in ANY_MONEY_RE.finditer(s):
+            pass
+        if last:
+            total_budget = _num(last.group(1))
 
     return city_code, check_in, check_out, adults, total_budget, currency, nights, q_location
 
+# (path into a Google Hotels property, value is per night?) in priority order
+_TOTAL_EXTRACTORS = (
+    (("total_rate", "lowest"), False),  # total for stay
+    (("rate_per_night",), True),
+    (("lowest_price",), True),          # some payloads expose 'lowest_price' directly
+    (("prices", 0, "price"), True),     # e.g., {"price": 120, "source": "Booking.com", ...}
+)
+
+def _dig(item: Any, path: Tuple) -> Any:
+    for key in path:
+        if isinstance(key, int):
+            if not isinstance(item, list) or len(item) <= key:
+                return None
+        elif not isinstance(item, dict):
+            return None
+        item = item[key] if isinstance(key, int) else item.get(key)
+    return item
+
+def _to_float(x: Any) -> Optional[float]:
+    if isinstance(x, (int, float, str)):
+        try:
+            return float(x)
+        except (ValueError, OverflowError):
+            return None
+    return None
+
 def _estimate_total(property_item: Dict[str, Any], nights: int) -> Optional[float]:
     """
     Heuristics across possible SerpAPI fields:
@@ -87,36 +125,10 @@ def _estimate_total(property_item: Dict[str, Any], nights: int) -> Optional[floa
     - Else lowest_price * nights
     - Else prices[0].price * nights (if present as number)
     """
-    total_rate = (property_item.get("total_rate") or {})
-    if isinstance(total_rate.get("lowest"), (int, float, str)):
-        try:
-            return float(total_rate["lowest"])
-        except Exception:
-            pass
-
-    if isinstance(property_item.get("rate_per_night"), (int, float, str)):
-        try:
-            return float(property_item["rate_per_night"]) * nights
-        except Exception:
-            pass
-
-    # Some payloads expose 'lowest_price' directly
-    if isinstance(property_item.get("lowest_price"), (int, float, str)):
-        try:
-            return float(property_item["lowest_price"]) * nights
-        except Exception:
-            pass
-
-    prices = property_item.get("prices") or []
-    if prices and isinstance(prices[0], dict):
-        # e.g., {"price": 120, "source": "Booking.com", ...}
-        p = prices[0].get("price")
-        if isinstance(p, (int, float, str)):
-            try:
-                return float(p) * nights
-            except Exception:
-                pass
-
+    for path, per_night in _TOTAL_EXTRACTORS:
+        value = _to_float(_dig(property_item, path))
+        if value is not None:
+            return value * nights if per_night else value
     return None
 
 def _rating_value(property_item: Dict[str, Any]) -> float:
@@ -127,36 +139,41 @@ def _rating_value(property_item: Dict[str, Any]) -> float:
     except Exception:
         return 0.0
 
-def _fetch_property_details(property_token: str, params_base: Dict[str, Any]) -> Dict[str, Any]:
+def _serpapi_get(params: Dict[str, Any], fresh: bool = False) -> Dict[str, Any]:
+    key = cache_key(params)
+    if not fresh:
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
+    # Pooled keep-alive session instead of a fresh connection per GoogleSearch call
+    resp = SESSION.get(SERPAPI_SEARCH_URL, params=params, timeout=60)
+    data = orjson.loads(resp.content) or {}
+    if not data.get("error"):
+        cache_set(key, data)
+    return data
+
+def _fetch_property_details(property_token: str, params_base: Dict[str, Any], fresh: bool = False) -> Dict[str, Any]:
     # https://serpapi.com/google-hotels-property-details
     details_params = dict(params_base)
     details_params.update({
         "property_token": property_token,
     })
-    details = GoogleSearch(details_params).get_dict()
-    return details or {}
+    return _serpapi_get(details_params, fresh=fresh)
 
-def search_best_lodging_from_hint_serpapi(
+def _build_hotels_query(
     hint: str,
     *,
-    gl: str = "ca",
-    hl: str = "en",
-    currency_default: str = "USD",
-    nightly_tolerance: float = 1.15,   # allow 15% over nightly budget
-    sort_by_lowest_price: bool = True
+    gl: str,
+    hl: str,
+    currency_default: str,
+    nightly_tolerance: float,
+    sort_by_lowest_price: bool,
+    fresh: bool = False,
 ) -> Dict[str, Any]:
     """
-    Parse hint -> Google Hotels via SerpAPI -> choose best within budget.
-    Returns { ok, cityCode, checkIn, checkOut, ... , hotel, offer }
+    Parse hint and build the Google Hotels request. Raises on unparseable hints.
     """
-    if not SERPAPI_API_KEY:
-        return {"ok": False, "error": "SERPAPI_API_KEY missing"}
-
-    try:
-        city_code, check_in, check_out, adults, total_budget, currency, nights, q_location = _parse_lodging_hint(hint)
-    except Exception as e:
-        return {"ok": False, "error": f"parse_error: {e}", "hint": hint}
-
+    city_code, check_in, check_out, adults, total_budget, currency, nights, q_location = _parse_lodging_hint(hint)
     currency = currency or currency_default
 
     # Budget -> nightly bounds for Google Hotels' price filters
@@ -175,72 +192,99 @@ def search_best_lodging_from_hint_serpapi(
         "currency": currency,
         "gl": gl,
         "hl": hl,
-        "no_cache": True,                    # always fresh results
     }
+    if fresh:
+        params["no_cache"] = True           # bypass SerpAPI's own cache too
     # sort_by options documented; 3 = lowest price
     if sort_by_lowest_price:
         params["sort_by"] = 3               # Lowest price
     if max_price is not None:
         params["max_price"] = max_price
 
-    # Query SerpAPI
-    res = GoogleSearch(params).get_dict()   # returns dict with 'properties', 'brands', etc.
-    props: List[Dict[str, Any]] = res.get("properties") or []
-
-    # Filter to hotels only (ignore vacation rentals unless you want them)
-    hotels = [p for p in props if (p.get("type") or "").lower() == "hotel"]
-    if not hotels and props:
-        hotels = props  # fall back to whatever is there
-
-    # Rank by: within budget (if any), then lowest total, tie-break by highest rating
-    scored: List[Dict[str, Any]] = []
-    for p in hotels:
-        total_est = _estimate_total(p, nights)
-        scored.append({**p, "_total_estimate": total_est})
-
-    def within_budget(p: Dict[str, Any]) -> bool:
-        if total_budget is None or p["_total_estimate"] is None:
-            return True if total_budget is None else False
-        return float(p["_total_estimate"]) <= total_budget * 1.12  # 12% total tolerance
-
-    pool = [p for p in scored if within_budget(p)]
-    if not pool:
-        pool = scored
-
-    def key_fn(p: Dict[str, Any]):
-        total = p["_total_estimate"] if p["_total_estimate"] is not None else float("inf")
-        return (total, -_rating_value(p))
+    return {
+        "city_code": city_code,
+        "check_in": check_in,
+        "check_out": check_out,
+        "adults": adults,
+        "total_budget": total_budget,
+        "currency": currency,
+        "nights": nights,
+        "q_location": q_location,
+        "max_price": max_price,
+        "params": params,
+    }
 
-    best = sorted(pool, key=key_fn)[0] if pool else None
-    if not best:
-        return {"ok": False, "error": "no_hotels_found", "meta": {"cityCode": city_code, "q": q_location}}
+def _details_params(query: Dict[str, Any]) -> Dict[str, Any]:
+    params = query["params"]
+    return {
+        "api_key": SERPAPI_API_KEY,
+        "engine": "google_hotels",
+        "gl": params["gl"], "hl": params["hl"], "currency": query["currency"],
+    }
 
-    # Optional: enrich with Property Details (address, phone, price breakdown)
-    details = {}
-    token = best.get("property_token")
-    if token:
-        details = _fetch_property_details(token, {
-            "api_key": SERPAPI_API_KEY,
-            "engine": "google_hotels",
-            "gl": gl, "hl": hl, "currency": currency
-        })
+def _pick_best_hotel(query: Dict[str, Any], res: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+    """
+    Choose the best property from a Google Hotels response.
+    Returns (best_or_None, counts).
+    """
+    nights = query["nights"]
+    total_budget = query["total_budget"]
+    props: List[Dict[str, Any]] = res.get("properties") or []
 
+    budget_cap = total_budget * 1.12 if total_budget is not None else None  # 12% total tolerance
+
+    def within_budget(total: Optional[float]) -> bool:
+        if budget_cap is None:
+            return True
+        return total is not None and total <= budget_cap
+
+    # Rank by: within budget (if any), then lowest total, tie-break by highest rating.
+    # Single pass keeping the cheapest property per within-budget bucket. Only hotels
+    # count once one has been seen (ignore vacation rentals unless you want them);
+    # until then, whatever is there is tracked as the fallback.
+    best: Dict[bool, Tuple[Tuple[float, float], Dict[str, Any], Optional[float]]] = {}
+    n_hotels = 0
+    for p in props:
+        is_hotel = (p.get("type") or "").lower() == "hotel"
+        if n_hotels and not is_hotel:
+            continue
+        if is_hotel and not n_hotels:
+            best.clear()
+        n_hotels += is_hotel
+        total_est = _estimate_total(p, nights)
+        key = (total_est if total_est is not None else float("inf"), -_rating_value(p))
+        for in_budget in ((True, False) if within_budget(total_est) else (False,)):
+            if in_budget not in best or key < best[in_budget][0]:
+                best[in_budget] = (key, p, total_est)
+
+    # Prefer the within-budget pool.
+    chosen = best.get(True) or best.get(False)
+    counts = {"returned": len(props), "hotels_considered": n_hotels or len(props)}
+    if not chosen:
+        return None, counts
+    _, p, total_est = chosen
+    return {**p, "_total_estimate": total_est}, counts
+
+def _no_hotels_result(query: Dict[str, Any]) -> Dict[str, Any]:
+    return {"ok": False, "error": "no_hotels_found", "meta": {"cityCode": query["city_code"], "q": query["q_location"]}}
+
+def _lodging_result(query: Dict[str, Any], best: Dict[str, Any], counts: Dict[str, int]) -> Dict[str, Any]:
     return {
         "ok": True,
-        "cityCode": city_code,
-        "checkIn": check_in,
-        "checkOut": check_out,
-        "nights": nights,
-        "adults": adults,
-        "budgetTotal": total_budget,
-        "currency": currency,
+        "cityCode": query["city_code"],
+        "checkIn": query["check_in"],
+        "checkOut": query["check_out"],
+        "nights": query["nights"],
+        "adults": query["adults"],
+        "budgetTotal": query["total_budget"],
+        "currency": query["currency"],
         "hotel": {
             "name": best.get("name"),
             "type": best.get("type"),
             "overall_rating": best.get("overall_rating"),
             "check_in_time": best.get("check_in_time"),
             "check_out_time": best.get("check_out_time"),
-            "property_token": token,
+            "property_token": best.get("property_token"),
             "serpapi_property_details_link": best.get("serpapi_property_details_link"),
             "images": best.get("images"),
         },
@@ -249,6 +293,96 @@ def search_best_lodging_from_hint_serpapi(
             "rate_per_night": best.get("rate_per_night"),
             "price_source": (best.get("prices") or [{}])[0].get("source") if best.get("prices") else None,
         },
-        "_counts": {"returned": len(props), "hotels_considered": len(hotels)},
-        "_debug": {"applied_max_price": max_price, "q": q_location}
+        "_counts": counts,
+        "_debug": {"applied_max_price": query["max_price"], "q": query["q_location"]}
     }
+
+def search_best_lodging_from_hint_serpapi(
+    hint: str,
+    *,
+    gl: str = "ca",
+    hl: str = "en",
+    currency_default: str = "USD",
+    nightly_tolerance: float = 1.15,   # allow 15% over nightly budget
+    sort_by_lowest_price: bool = True,
+    fresh: bool = False,               # skip the local + SerpAPI response caches
+) -> Dict[str, Any]:
+    """
+    Parse hint -> Google Hotels via SerpAPI -> choose best within budget.
+    Returns { ok, cityCode, checkIn, checkOut, ... , hotel, offer }
+    """
+    if not SERPAPI_API_KEY:
+        return {"ok": False, "error": "SERPAPI_API_KEY missing"}
+
+    try:
+        query = _build_hotels_query(
+            hint, gl=gl, hl=hl, currency_default=currency_default,
+            nightly_tolerance=nightly_tolerance, sort_by_lowest_price=sort_by_lowest_price, fresh=fresh,
+        )
+    except Exception as e:
+        return {"ok": False, "error": f"parse_error: {e}", "hint": hint}
+
+    # Query SerpAPI
+    res = _serpapi_get(query["params"], fresh=fresh)   # returns dict with 'properties', 'brands', etc.
+    best, counts = _pick_best_hotel(query, res)
+    if not best:
+        return _no_hotels_result(query)
+
+    # Optional: enrich with Property Details (address, phone, price breakdown)
+    token = best.get("property_token")
+    if token:
+        _fetch_property_details(token, _details_params(query), fresh=fresh)
+
+    return _lodging_result(query, best, counts)
+
+async def _serpapi_get_async(params: Dict[str, Any], fresh: bool = False) -> Dict[str, Any]:
+    key = cache_key(params)
+    # The SQLite cache blocks (file I/O, shared lock), so keep it off the event loop
+    if not fresh:
+        cached = await asyncio.to_thread(cache_get, key)
+        if cached is not None:
+            return cached
+    async with ASYNC_SEMAPHORE:
+        resp = await get_async_client().get(SERPAPI_SEARCH_URL, params=params)
+    if resp.status_code >= 400:
+        return {"error": f"SerpAPI HTTP {resp.status_code}"}
+    data = orjson.loads(resp.content) or {}
+    if not data.get("error"):
+        await asyncio.to_thread(cache_set, key, data)
+    return data
+
+async def search_best_lodging_from_hint_serpapi_async(
+    hint: str,
+    *,
+    gl: str = "ca",
+    hl: str = "en",
+    currency_default: str = "USD",
+    nightly_tolerance: float = 1.15,
+    sort_by_lowest_price: bool = True,
+    fresh: bool = False,
+) -> Dict[str, Any]:
+    """
+    Async search_best_lodging_from_hint_serpapi; multi-destination callers can
+    asyncio.gather several hints so they share one round trip of latency.
+    """
+    if not SERPAPI_API_KEY:
+        return {"ok": False, "error": "SERPAPI_API_KEY missing"}
+
+    try:
+        query = _build_hotels_query(
+            hint, gl=gl, hl=hl, currency_default=currency_default,
+            nightly_tolerance=nightly_tolerance, sort_by_lowest_price=sort_by_lowest_price, fresh=fresh,
+        )
+    except Exception as e:
+        return {"ok": False, "error": f"parse_error: {e}", "hint": hint}
+
+    res = await _serpapi_get_async(query["params"], fresh=fresh)
+    best, counts = _pick_best_hotel(query, res)
+    if not best:
+        return _no_hotels_result(query)
+
+    token = best.get("property_token")
+    if token:
+        await _serpapi_get_async({**_details_params(query), "property_token": token}, fresh=fresh)
+
+    return _lodging_result(query, best, counts)
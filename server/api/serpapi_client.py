@@ -0,0 +1,109 @@
+# api/serpapi_client.py
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SERPAPI_SEARCH_URL = "https://serpapi.com/search.json"
+
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,  # hand the final response back so SerpAPI's error JSON is readable
+)
+
+def _build_session() -> requests.Session:
+    """Keep-alive session shared by every SerpAPI call, with transport-level retries."""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=RETRY))
+    return session
+
+SESSION = _build_session()
+
+# Cap on in-flight async SerpAPI requests per process; multi-trip payloads fan out
+# widely and bursts past the provider's limits only come back as slower 429 retries
+SERPAPI_CONCURRENCY = int(os.getenv("SERPAPI_CONCURRENCY", "10"))
+ASYNC_SEMAPHORE = asyncio.Semaphore(SERPAPI_CONCURRENCY)
+
+_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Async counterpart of SESSION, shared by every async SerpAPI call (flights and
+    lodging) so concurrent trips reuse one connection pool. Created lazily inside
+    the running event loop; close it with aclose_async_client on shutdown.
+    """
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            transport=httpx.AsyncHTTPTransport(retries=RETRY.total),  # connect errors only
+        )
+    return _ASYNC_CLIENT
+
+async def aclose_async_client() -> None:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        client, _ASYNC_CLIENT = _ASYNC_CLIENT, None
+        await client.aclose()
+
+# --- Response cache ---------------------------------------------------------
+# SerpAPI searches are slow and metered; identical queries within the TTL are
+# served from a local SQLite file shared by all workers on the host.
+log = logging.getLogger(__name__)
+
+CACHE_PATH = os.getenv("SERPAPI_CACHE_PATH", os.path.join(tempfile.gettempdir(), "serpapi_cache.sqlite3"))
+CACHE_TTL_SEC = 3600
+
+_cache_lock = threading.Lock()
+_cache_conn: Optional[sqlite3.Connection] = None
+
+def _cache_db() -> sqlite3.Connection:
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(CACHE_PATH, timeout=5, check_same_thread=False)
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL NOT NULL, body BLOB NOT NULL)"
+        )
+    return _cache_conn
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """Stable key for a SerpAPI query; credentials and cache flags are not part of it."""
+    key_params = {k: v for k, v in params.items() if k not in ("api_key", "no_cache")}
+    return hashlib.blake2b(orjson.dumps(key_params, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+def cache_get(key: str, ttl: float = CACHE_TTL_SEC) -> Optional[Dict[str, Any]]:
+    try:
+        with _cache_lock:
+            row = _cache_db().execute(
+                "SELECT body FROM responses WHERE key = ? AND stored_at >= ?", (key, time.time() - ttl)
+            ).fetchone()
+    except sqlite3.Error as e:
+        log.warning("SerpAPI cache read failed: %s", e)
+        return None
+    return orjson.loads(row[0]) if row else None
+
+def cache_set(key: str, data: Dict[str, Any]) -> None:
+    try:
+        with _cache_lock, _cache_db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, stored_at, body) VALUES (?, ?, ?)",
+                (key, time.time(), orjson.dumps(data)),
+            )
+    except sqlite3.Error as e:
+        log.warning("SerpAPI cache write failed: %s", e)
@@ -3,35 +3,57 @@ from dotenv import load_dotenv
 
 load_dotenv()
 import os
+from typing import List, Tuple
 
 # CONFIGURATION
 PINECONE_API_KEY =  os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 
-# Init client
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# Init client: the gRPC transport (pinecone[grpc]) skips JSON encoding on fetch/upsert
+# and keeps one multiplexed channel; fall back to REST if it isn't installed or
+# PINECONE_TRANSPORT=rest. Both expose the same index.fetch/upsert surface.
+try:
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+
+if PineconeGRPC is not None and os.getenv("PINECONE_TRANSPORT", "grpc").lower() != "rest":
+    pc = PineconeGRPC(api_key=PINECONE_API_KEY)
+else:
+    pc = Pinecone(api_key=PINECONE_API_KEY)
 index = pc.Index(PINECONE_INDEX_NAME)
 
+EMBED_MODEL = "llama-text-embed-v2"
+EMBED_BATCH_SIZE = 96  # max inputs per llama-text-embed-v2 embed request
+
+def add_users_pinecone_batch(users: List[Tuple[str, str, str]], batch_size: int = EMBED_BATCH_SIZE):
+    """Add many users to Pinecone index: one embed + one upsert call per batch.
+
+    users: (user_id, username, text) tuples.
+    """
+    for start in range(0, len(users), batch_size):
+        chunk = users[start:start + batch_size]
+        embed_response = pc.inference.embed(
+            model=EMBED_MODEL,
+            inputs=[text for _, _, text in chunk],
+            parameters={"input_type": "query"}
+        )
+
+        if not embed_response.data or len(embed_response.data) != len(chunk):
+            raise ValueError("Embedding failed or returned empty result")
+
+        index.upsert(vectors=[
+            {
+                "id": user_id,
+                "values": embedding["values"],
+                "metadata": {"username": username}
+            }
+            for (user_id, username, _), embedding in zip(chunk, embed_response.data)
+        ])
+
 def add_user_pinecone(user_id: str, username: str, text: str = "default user profile"):
     """Add user to Pinecone index."""
-    embed_response = pc.inference.embed(
-        model="llama-text-embed-v2",
-        inputs=[text],
-        parameters={"input_type": "query"}
-    )
-
-    if not embed_response.data:
-        raise ValueError("Embedding failed or returned empty result")
-
-    embedding = embed_response.data[0]["values"]
-
-    index.upsert(vectors=[
-        {
-            "id": user_id,
-            "values": embedding,
-            "metadata": {"username": username}
-        }
-    ])
+    add_users_pinecone_batch([(user_id, username, text)])
 
 def get_context_from_pinecone(user_id: str):
     """Fetch user context from Pinecone index."""
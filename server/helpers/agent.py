@@ -1,13 +1,22 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
+from langchain_core.utils.json import parse_partial_json
 
 from dotenv import load_dotenv
 import os
 import json
+import orjson
 import re
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator, Tuple
 import time
+import asyncio
+import hashlib
+import logging
+import threading
+from cachetools import TTLCache
+
+log = logging.getLogger(__name__)
 
 # ------------ Env & LLM ------------
 load_dotenv()
@@ -23,7 +32,65 @@ llm = ChatGoogleGenerativeAI(
     api_key=GOOGLE_API_KEY,
 )
 
+# Raw breakdown replies keyed by a hash of the LLM inputs; identical trips skip Gemini.
+# Set TRIP_CACHE_ENABLED=0 to always call the model.
+TRIP_CACHE_ENABLED = os.getenv("TRIP_CACHE_ENABLED", "1") != "0"
+_LLM_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=24 * 3600)
+# Same replies with the ISO dates swapped for placeholders, keyed on every other input:
+# a trip that only differs in dates reuses one instead of calling the model
+_PLAN_TEMPLATES: TTLCache = TTLCache(maxsize=4096, ttl=7 * 24 * 3600)
+_LLM_CACHE_LOCK = threading.Lock()
+
+# Top-level sections of a plan, in the order the prompt asks for them
+PLAN_SECTIONS = ("flights", "lodging", "transportation", "activities", "food")
+
+def _string_lists(*keys: str) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {k: {"type": "array", "items": {"type": "string"}} for k in keys},
+        "required": list(keys),
+        "propertyOrdering": list(keys),
+    }
+
+# Response schema for the breakdown (mirrors the JSON shape in breakdown_template)
+TRIP_QUERY_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "flights": _string_lists("serpapi"),
+        "lodging": _string_lists("Expedia"),
+        "transportation": _string_lists("public_transit", "uber", "car_rental"),
+        "activities": _string_lists("eventbrite", "tripadvisor"),
+        "food": _string_lists("yelp"),
+    },
+    "required": list(PLAN_SECTIONS),
+    "propertyOrdering": list(PLAN_SECTIONS),
+}
+
+# Gemini structured output: replies are bare JSON matching TRIP_QUERY_SCHEMA, so the
+# regex salvage and key checks below are only a safety net
+llm_json = llm.bind(response_mime_type="application/json", response_schema=TRIP_QUERY_SCHEMA)
+
+# Outermost {...} span in an LLM reply that wraps its JSON in prose/fences
+JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+# Already an IATA code (3 uppercase letters)
+IATA_CODE_RE = re.compile(r"^[A-Z]{3}$")
+# Dates/pax/etc. trailing a city name in a flight query
+TRAILING_DETAILS_RE = re.compile(r"\d+.*$")
+# A flight query that is already in canonical "AAA -> BBB <details>" form (fullmatch)
+IATA_PAIR_QUERY_RE = re.compile(r"[A-Z]{3} -> [A-Z]{3}(?: \d\S*(?: \S+)*)?")
+
 # ------------ Date parsing helpers ------------
+# Supported formats keyed by (starts with a digit?, separator). strptime needs the
+# separator literally, so dispatching on it skips formats that could only raise.
+DATE_FORMATS_BY_KIND = {
+    (True, "-"): ("%Y-%m-%d",),
+    (True, "/"): ("%m/%d/%Y", "%Y/%m/%d"),
+    (True, " "): ("%d %b %Y",      # 26 Aug 2025
+                  "%d %B %Y"),     # 26 August 2025
+    (False, ","): ("%B %d, %Y",),  # August 26, 2025
+    (False, " "): ("%b %d %Y",),   # Aug 26 2025
+}
+
 def to_iso_date(s: str) -> Optional[str]:
     """
     Try multiple common formats. Extend as needed.
@@ -36,20 +103,14 @@ def to_iso_date(s: str) -> Optional[str]:
     if not s:
         return None
     s = s.strip()
+    if not s:
+        return None
 
-    fmts = [
-        "%Y-%m-%d",
-        "%b %d %Y",      # Aug 26 2025
-        "%B %d, %Y",     # August 26, 2025
-        "%d %b %Y",      # 26 Aug 2025
-        "%d %B %Y",      # 26 August 2025
-        "%m/%d/%Y",
-        "%Y/%m/%d",
-    ]
-    for fmt in fmts:
+    sep = "-" if "-" in s else "/" if "/" in s else "," if "," in s else " "
+    for fmt in DATE_FORMATS_BY_KIND.get((s[0].isdigit(), sep), ()):
         try:
             return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
-        except Exception:
+        except ValueError:
             pass
     return None
 
@@ -70,48 +131,7 @@ Generate search queries for:
 3. Activities: Based on interests
 
 
-CRITICAL: For flights, you MUST convert city names to IATA airport codes. Here are the most common conversions:
-
-Major US Cities:
-- Miami FL → MIA
-- New York NY → JFK
-- Los Angeles CA → LAX
-- Chicago IL → ORD
-- San Francisco CA → SFO
-
-Major International Cities:
-- Toronto Canada → YYZ
-- London UK → LHR
-- Paris France → CDG
-- Madrid Spain → MAD
-- Athens Greece → ATH
-- Rome Italy → FCO
-- Berlin Germany → BER
-- Tokyo Japan → NRT
-- Beijing China → PEK
-- Sydney Australia → SYD
-- Mumbai India → BOM
-- Amsterdam Netherlands → AMS
-- Barcelona Spain → BCN
-- Milan Italy → MXP
-- Munich Germany → MUC
-- Vienna Austria → VIE
-- Prague Czech Republic → PRG
-- Budapest Hungary → BUD
-- Warsaw Poland → WAW
-- Stockholm Sweden → ARN
-- Oslo Norway → OSL
-- Copenhagen Denmark → CPH
-- Helsinki Finland → HEL
-- Dublin Ireland → DUB
-- Edinburgh Scotland → EDI
-- Glasgow Scotland → GLA
-- Manchester UK → MAN
-- Birmingham UK → BHX
-- Bristol UK → BRS
-- Newcastle UK → NCL
-- Belfast Northern Ireland → BFS
-- Cork Ireland → ORK
+CRITICAL: For flights, convert city names to IATA airport codes (e.g., Toronto Canada → YYZ). If unsure, keep the city name; the system converts it.
 
 CRITICAL FOR LODGING: 
 - Make sure the budget is 1/4 of the total trip budget
@@ -169,44 +189,58 @@ breakdown_prompt = PromptTemplate(
     template=breakdown_template
 )
 
+# Built once and shared by every request (sync, async and batch paths)
+breakdown_chain = breakdown_prompt | llm_json
+
 # ------------ Utilities ------------
+# Common IATA codes mapping (lowercased city name -> code), built once at import
+_IATA_LOOKUP: Dict[str, str] = {
+    "toronto": "YYZ", "toronto canada": "YYZ", "toronto ontario": "YYZ",
+    "new york": "JFK", "new york usa": "JFK", "new york ny": "JFK", "new york city": "JFK",
+}
+
+def _lookup_iata(city_name: str) -> str:
+    """
+    City name -> IATA code via _IATA_LOOKUP; "Toronto, ON" falls back to the part
+    before the comma. Returns the input unchanged if not found.
+    """
+    city_lower = city_name.lower().strip()
+    return (
+        _IATA_LOOKUP.get(city_lower)
+        or _IATA_LOOKUP.get(city_lower.split(",", 1)[0].strip())
+        or city_name
+    )
+
+# (section, key) of every query list that must carry the ISO date range
+DATED_QUERY_KEYS = (
+    ("flights", "serpapi"),
+    ("lodging", "Expedia"),
+    ("transportation", "public_transit"),
+    ("transportation", "uber"),
+    ("transportation", "car_rental"),
+    ("activities", "eventbrite"),
+    ("activities", "tripadvisor"),
+    ("food", "yelp"),
+)
+
 def force_dates_into_queries(data: Dict[str, Any], start_iso: str, end_iso: str) -> Dict[str, Any]:
     """
     Ensure every query string includes the ISO date range. If missing,
     append " {start_iso} to {end_iso}" at the end.
     """
-    def ensure_list_with_dates(lst: List[str]) -> List[str]:
-        out = []
-        for q in lst:
-            if q is None:
-                continue
-            q_str = str(q)
-            if (start_iso not in q_str) or (end_iso not in q_str):
-                q_str = f"{q_str} {start_iso} to {end_iso}"
-            out.append(q_str.strip())
-        return out
-
-    # Walk expected structure
-    if "flights" in data and "serpapi" in data["flights"]:
-        data["flights"]["serpapi"] = ensure_list_with_dates(data["flights"]["serpapi"])
-
-    if "lodging" in data and "Expedia" in data["lodging"]:
-        data["lodging"]["Expedia"] = ensure_list_with_dates(data["lodging"]["Expedia"])
-
-    if "transportation" in data:
-        t = data["transportation"]
-        for key in ["public_transit", "uber", "car_rental"]:
-            if key in t and isinstance(t[key], list):
-                t[key] = ensure_list_with_dates(t[key])
-
-    if "activities" in data:
-        a = data["activities"]
-        for key in ["eventbrite", "tripadvisor"]:
-            if key in a and isinstance(a[key], list):
-                a[key] = ensure_list_with_dates(a[key])
-
-    if "food" in data and "yelp" in data["food"]:
-        data["food"]["yelp"] = ensure_list_with_dates(data["food"]["yelp"])
+    suffix = f" {start_iso} to {end_iso}"
+
+    def with_dates(q: Any) -> str:
+        q_str = str(q)
+        if start_iso not in q_str or end_iso not in q_str:
+            q_str += suffix
+        return q_str.strip()
+
+    # Walk expected structure once
+    for section, key in DATED_QUERY_KEYS:
+        group = data.get(section)
+        if isinstance(group, dict) and isinstance(group.get(key), list):
+            group[key] = [with_dates(q) for q in group[key] if q is not None]
 
     return data
 
@@ -218,30 +252,24 @@ def ensure_iata_codes_in_flights(data: Dict[str, Any], departure: str, destinati
     if "flights" not in data or "serpapi" not in data["flights"]:
         return data
     
-    # Common IATA codes mapping
-    COMMON_IATA_CODES = {
-        "toronto": "YYZ", "toronto canada": "YYZ", "toronto ontario": "YYZ",
-        "new york": "JFK", "new york usa": "JFK", "new york ny": "JFK", "new york city": "JFK",
-    }
-    
     def get_iata_code(city_name: str) -> str:
         """Convert city name to IATA code"""
         if not city_name:
             return city_name
         
         # Check if it's already an IATA code (3 uppercase letters)
-        import re
-        if re.match(r'^[A-Z]{3}$', city_name):
+        if IATA_CODE_RE.match(city_name):
             return city_name
         
-        # Try to find in our mapping
-        city_lower = city_name.lower().strip()
-        return COMMON_IATA_CODES.get(city_lower, city_name)
+        return _lookup_iata(city_name)
     
     def convert_flight_query(query: str) -> str:
         """Convert city names to IATA codes in flight query"""
         if not query or "->" not in query:
             return query
+        # Most LLM replies already use IATA codes; nothing to rewrite
+        if IATA_PAIR_QUERY_RE.fullmatch(query):
+            return query
         
         # Split by arrow
         parts = query.split("->")
@@ -252,9 +280,8 @@ def ensure_iata_codes_in_flights(data: Dict[str, Any], departure: str, destinati
         dest_part = parts[1].strip()
         
         # Extract city names (remove dates, numbers, etc.)
-        import re
-        origin_city = re.sub(r'\d+.*$', '', origin_part).strip()
-        dest_city = re.sub(r'\d+.*$', '', dest_part).strip()
+        origin_city = TRAILING_DETAILS_RE.sub('', origin_part).strip()
+        dest_city = TRAILING_DETAILS_RE.sub('', dest_part).strip()
         
         # Convert to IATA codes
         origin_iata = get_iata_code(origin_city)
@@ -279,125 +306,221 @@ def ensure_iata_codes_in_flights(data: Dict[str, Any], departure: str, destinati
             processed_query = convert_flight_query(query)
             processed_queries.append(processed_query)
             if processed_query != query:
-                print(f"[agent] Converted flight query: {query} -> {processed_query}")
+                log.debug("Converted flight query: %s -> %s", query, processed_query)
         else:
             processed_queries.append(query)
     
     data["flights"]["serpapi"] = processed_queries
     return data
 
+# Upstream statuses worth another attempt; other 4xx errors fail immediately
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# "429 Resource has been exhausted", "Invalid argument provided to Gemini: 400 ..."
+ERROR_STATUS_RE = re.compile(r"(?:^|: )([45]\d\d) ")
+# Server-suggested wait in RetryInfo / Retry-After text, e.g. "retry_delay { seconds: 12"
+RETRY_DELAY_RE = re.compile(r"retry[_ -]?(?:delay|after)\D{0,20}(\d+(?:\.\d+)?)", re.I)
+MAX_RETRY_DELAY_SEC = 60.0
+
+def _error_status(err: BaseException) -> Optional[int]:
+    """HTTP-style status of an LLM error (google.api_core .code, .response.status_code, or the message)."""
+    e: Optional[BaseException] = err
+    for _ in range(5):  # walk a few links of the __cause__/__context__ chain
+        if e is None:
+            break
+        code = getattr(e, "code", None)
+        if isinstance(code, int) and 400 <= code < 600:
+            return code
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return status
+        e = e.__cause__ or e.__context__
+    text = str(err)
+    if "RESOURCE_EXHAUSTED" in text:
+        return 429
+    m = ERROR_STATUS_RE.search(text)
+    return int(m.group(1)) if m else None
+
+def _retry_after(err: BaseException) -> Optional[float]:
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    raw = headers.get("retry-after") if hasattr(headers, "get") else None
+    if raw is None:
+        m = RETRY_DELAY_RE.search(str(err))
+        raw = m.group(1) if m else None
+    try:
+        return min(MAX_RETRY_DELAY_SEC, float(raw)) if raw is not None else None
+    except ValueError:
+        return None
+
+def _retry_wait(err: Exception, attempt: int, backoff_sec: float) -> Optional[float]:
+    """Seconds to wait before the next attempt, or None if err isn't worth retrying."""
+    status = _error_status(err)
+    if status is not None and status not in RETRYABLE_STATUS:
+        log.warning("LLM error %s is not retryable", status)
+        return None
+    # Rate limited: honor the server's retry window when it sends one
+    if status == 429:
+        delay = _retry_after(err)
+        if delay is not None:
+            log.warning("Rate limited, waiting %ss before retry", delay)
+            return delay
+    # If it's a clear API error, wait longer
+    if status is not None:
+        wait_time = backoff_sec * (attempt ** 1.5)  # Exponential backoff
+        log.warning("API error detected, waiting %ss before retry", wait_time)
+        return wait_time
+    # For other errors (network etc.), shorter wait
+    return backoff_sec * attempt
+
 def invoke_with_retry(chain, inputs: dict, attempts: int = 3, backoff_sec: float = 2.0):
     """
-    Retry for occasional upstream 500s with better error handling.
+    Retry for occasional upstream 429/5xx with better error handling; other
+    4xx errors are raised right away, and there's no sleep after the last attempt.
     """
     last_err = None
     for i in range(1, attempts + 1):
         try:
-            print(f"[TripPilot] LLM attempt {i}/{attempts}")
+            log.debug("LLM attempt %d/%d", i, attempts)
             return chain.invoke(inputs)
         except Exception as e:
             last_err = e
-            print(f"[TripPilot] LLM attempt {i} failed: {e}")
-            
-            # If it's a clear API error, wait longer
-            if "InternalServerError" in str(e) or "500" in str(e):
-                wait_time = backoff_sec * (i ** 1.5)  # Exponential backoff
-                print(f"[TripPilot] API error detected, waiting {wait_time}s before retry")
-                time.sleep(wait_time)
-            else:
-                # For other errors, shorter wait
-                time.sleep(backoff_sec * i)
+            log.warning("LLM attempt %d failed: %s", i, e)
+            wait = _retry_wait(e, i, backoff_sec)
+            if wait is None:
+                raise
+            if i < attempts:
+                time.sleep(wait)
                 
-    print(f"[TripPilot] All {attempts} LLM attempts failed")
+    log.error("All %d LLM attempts failed", attempts)
+    raise last_err
+
+# Cap concurrent Gemini calls from generate_many/generate_travel_plans_batch to stay under the API's QPS limits
+LLM_CONCURRENCY = 8
+_llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+# Send a duplicate Gemini request if the first hasn't answered within this long
+# (async path only). Off by default: a breakdown normally takes seconds, and each
+# hedge is a second paid request, so set LLM_HEDGE_MS above the observed p95 latency.
+LLM_HEDGE_SEC = float(os.getenv("LLM_HEDGE_MS", "0")) / 1000
+
+async def _ainvoke_with_permit(chain, inputs: dict):
+    # The hedge is an extra Gemini call, so it takes its own LLM_CONCURRENCY slot
+    async with _llm_semaphore:
+        return await chain.ainvoke(inputs)
+
+async def hedged_ainvoke(chain, inputs: dict, hedge_sec: float):
+    """
+    chain.ainvoke, plus a second identical request once hedge_sec passes without an
+    answer. Returns whichever succeeds first and cancels the other, so tail latency
+    is bounded by the hedge rather than by one slow upstream call.
+    """
+    tasks = [asyncio.ensure_future(chain.ainvoke(inputs))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_sec)
+        if not done:
+            log.info("No LLM reply after %ss, sending hedged request", hedge_sec)
+            tasks.append(asyncio.ensure_future(_ainvoke_with_permit(chain, inputs)))
+
+        last_err = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_err = task.exception()
+        raise last_err
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def ainvoke_with_retry(chain, inputs: dict, attempts: int = 3, backoff_sec: float = 2.0,
+                             hedge_sec: Optional[float] = None):
+    """
+    Async invoke_with_retry; waits with asyncio.sleep so other trips keep running.
+    With hedge_sec, each attempt is a hedged_ainvoke.
+    """
+    last_err = None
+    for i in range(1, attempts + 1):
+        try:
+            log.debug("LLM attempt %d/%d", i, attempts)
+            if hedge_sec:
+                return await hedged_ainvoke(chain, inputs, hedge_sec)
+            return await chain.ainvoke(inputs)
+        except Exception as e:
+            last_err = e
+            log.warning("LLM attempt %d failed: %s", i, e)
+            wait = _retry_wait(e, i, backoff_sec)
+            if wait is None:
+                raise
+            if i < attempts:
+                await asyncio.sleep(wait)
+
+    log.error("All %d LLM attempts failed", attempts)
     raise last_err
 
 # ------------ Main functions ------------
+test_chain = PromptTemplate(
+    input_variables=["test"],
+    template="Say 'Hello {test}' and nothing else."
+) | llm
+
 def test_llm_connection():
     """Test if the LLM is working with a simple prompt"""
     try:
-        test_prompt = PromptTemplate(
-            input_variables=["test"],
-            template="Say 'Hello {test}' and nothing else."
-        )
-        test_chain = test_prompt | llm
         response = test_chain.invoke({"test": "World"})
         content = response.content if hasattr(response, "content") else str(response)
-        print(f"[TripPilot] LLM test successful: {content}")
+        log.info("LLM test successful: %s", content)
         return True
     except Exception as e:
-        print(f"[TripPilot] LLM test failed: {e}")
+        log.error("LLM test failed: %s", e)
         return False
 
+# (section, key, query template) for each query in a fallback plan, built once;
+# create_fallback_plan fills them from the trip with format_map
+FALLBACK_QUERIES = (
+    ("flights", "serpapi", "{departure_iata}->{destination_iata} {start} to {end} {travelers} pax economy"),
+    ("lodging", "Expedia", "{destination} hotels {start} to {end} {travelers} guests"),
+    ("transportation", "public_transit", "{destination} public transit {start} to {end}"),
+    ("transportation", "uber", "{destination} airport transfer {start} to {end}"),
+    ("transportation", "car_rental", "{destination} car rental {start} to {end}"),
+    ("activities", "eventbrite", "{destination} {interests} {start} to {end}"),
+    ("activities", "tripadvisor", "{destination} attractions {interests} {start} to {end}"),
+    ("food", "yelp", "{destination} restaurants {start} to {end}"),
+)
+
 def create_fallback_plan(trip: dict, start_iso: str, end_iso: str) -> dict:
     """Create a basic fallback plan when LLM fails"""
     departure = trip.get("departure", "")
     destination = trip.get("destination", "")
-    travelers = trip.get("travelers", "")
-    interests = trip.get("interests", "")
-    
-    # Simple IATA code mapping for common cities
-    def get_iata_code(city_name):
-        city_lower = city_name.lower()
-        iata_map = {
-            "toronto": "YYZ", "toronto canada": "YYZ", "toronto ontario": "YYZ",
-            "new york": "JFK", "new york usa": "JFK", "new york ny": "JFK", "new york city": "JFK",
-        }
-        return iata_map.get(city_lower, city_name)  # Return original if not found
-    
-    departure_iata = get_iata_code(departure)
-    destination_iata = get_iata_code(destination)
-    
-    return {
-        "flights": {
-            "serpapi": [
-                f"{departure_iata}->{destination_iata} {start_iso} to {end_iso} {travelers} pax economy"
-            ]
-        },
-        "lodging": {
-            "Expedia": [
-                f"{destination} hotels {start_iso} to {end_iso} {travelers} guests"
-            ]
-        },
-        "transportation": {
-            "public_transit": [
-                f"{destination} public transit {start_iso} to {end_iso}"
-            ],
-            "uber": [
-                f"{destination} airport transfer {start_iso} to {end_iso}"
-            ],
-            "car_rental": [
-                f"{destination} car rental {start_iso} to {end_iso}"
-            ]
-        },
-        "activities": {
-            "eventbrite": [
-                f"{destination} {interests} {start_iso} to {end_iso}"
-            ],
-            "tripadvisor": [
-                f"{destination} attractions {interests} {start_iso} to {end_iso}"
-            ]
-        },
-        "food": {
-            "yelp": [
-                f"{destination} restaurants {start_iso} to {end_iso}"
-            ]
-        },
-        "_meta": {"startISO": start_iso, "endISO": end_iso, "fallback": True}
+    fields = {
+        "departure_iata": _lookup_iata(departure),
+        "destination_iata": _lookup_iata(destination),
+        "destination": destination,
+        "travelers": trip.get("travelers", ""),
+        "interests": trip.get("interests", ""),
+        "start": start_iso,
+        "end": end_iso,
     }
 
-def breakdown_trip_to_queries(trip: dict) -> dict:
+    plan: Dict[str, Any] = {}
+    for section, key, template in FALLBACK_QUERIES:
+        plan.setdefault(section, {})[key] = [template.format_map(fields)]
+    plan["_meta"] = {"startISO": start_iso, "endISO": end_iso, "fallback": True}
+    return plan
+
+def _breakdown_inputs(trip: dict) -> Dict[str, Any]:
     # 1) Parse dates to ISO
     start_iso = to_iso_date(trip.get("startDate", ""))
     end_iso = to_iso_date(trip.get("endDate", ""))
 
     # 2) Debug prints (these will show in your server logs)
-    print(f"[TripPilot] Parsed ISO dates -> startISO={start_iso}, endISO={end_iso}")
+    log.debug("Parsed ISO dates -> startISO=%s, endISO=%s", start_iso, end_iso)
 
     if not start_iso or not end_iso:
         raise ValueError(f"Could not parse dates to ISO. startDate='{trip.get('startDate')}', endDate='{trip.get('endDate')}'")
 
     # 3) Build inputs including ISO dates
-    llm_inputs = {
+    return {
         "departure": trip.get("departure", ""),
         "destination": trip.get("destination", ""),
         "budget": trip.get("budget", ""),
@@ -407,44 +530,44 @@ def breakdown_trip_to_queries(trip: dict) -> dict:
         "interests": trip.get("interests", ""),
     }
 
-    chain = breakdown_prompt | llm
+def _response_content(response) -> str:
+    content = response.content if hasattr(response, "content") else str(response)
 
-    # 4) Invoke with retry and better error handling
-    try:
-        response = invoke_with_retry(chain, llm_inputs, attempts=3)
-        content = response.content if hasattr(response, "content") else str(response)
-        
-        print(f"[TripPilot] Raw LLM response: {content[:500]}...")
-        
-        if not content or content.strip() == "":
-            print("[TripPilot] Empty response received from LLM")
-            raise ValueError("Empty response from breakdown_chain")
-            
-    except Exception as e:
-        print(f"[TripPilot] Error during LLM invocation: {e}")
-        raise ValueError(f"LLM invocation failed: {e}")
+    log.debug("Raw LLM response: %.500s...", content)
+
+    if not content or content.strip() == "":
+        log.warning("Empty response received from LLM")
+        raise ValueError("Empty response from breakdown_chain")
+    return content
+
+def _plan_from_content(content: str, trip: dict, llm_inputs: Dict[str, Any]) -> dict:
+    start_iso, end_iso = llm_inputs["startISO"], llm_inputs["endISO"]
 
     # 5) Extract JSON with better error handling
     content = content.strip()
     if not content.startswith("{"):
-        m = re.search(r"\{.*\}", content, re.DOTALL)
+        m = JSON_OBJECT_RE.search(content)
         if not m:
-            print(f"[TripPilot] Raw LLM content (no JSON found): {content}")
+            log.warning("Raw LLM content (no JSON found): %s", content)
             raise ValueError("No JSON found in response")
         content = m.group(0)
 
     try:
-        data = json.loads(content)
-    except json.JSONDecodeError as e:
-        print(f"[TripPilot] JSON decode error: {e}")
-        print(f"[TripPilot] Response content:\n{content}")
-        raise ValueError(f"Invalid JSON from breakdown_chain: {content}")
+        data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        # stdlib json also accepts NaN/Infinity, which orjson rejects
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            log.warning("JSON decode error: %s\nResponse content:\n%s", e, content)
+            raise ValueError(f"Invalid JSON from breakdown_chain: {content}")
 
     # 6) Light validation (match the prompt's schema)
-    required_top = ["flights", "lodging", "transportation", "activities", "food"]
-    for k in required_top:
+    for k in PLAN_SECTIONS:
         if k not in data:
             raise ValueError(f"Missing '{k}' in JSON")
+        if not isinstance(data[k], dict):
+            raise ValueError(f"'{k}' is not an object in JSON")
 
     if "serpapi" not in data["flights"]:
         raise ValueError("Missing 'flights.serpapi' in JSON")
@@ -452,16 +575,6 @@ def breakdown_trip_to_queries(trip: dict) -> dict:
     if "Expedia" not in data["lodging"]:
         raise ValueError("Missing 'lodging.Expedia' in JSON")
 
-    t = data["transportation"]
-    for k in ["public_transit", "uber", "car_rental"]:
-        _ = t.get(k, [])
-
-    a = data["activities"]
-    for k in ["eventbrite", "tripadvisor"]:
-        _ = a.get(k, [])
-
-    _ = data["food"].get("yelp", [])
-
     # 7) Force ISO dates into every query string
     data = force_dates_into_queries(data, start_iso, end_iso)
     
@@ -473,14 +586,202 @@ def breakdown_trip_to_queries(trip: dict) -> dict:
 
     return data
 
+def _llm_cache_key(llm_inputs: Dict[str, Any]) -> str:
+    raw = orjson.dumps(llm_inputs, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def _template_key(llm_inputs: Dict[str, Any]) -> str:
+    shape = {k: str(v).strip().lower() for k, v in llm_inputs.items() if k not in ("startISO", "endISO")}
+    # Only same-length trips share a template: totals and per-night wording depend on it
+    shape["nights"] = (
+        datetime.fromisoformat(llm_inputs["endISO"]) - datetime.fromisoformat(llm_inputs["startISO"])
+    ).days
+    return _llm_cache_key(shape)
+
+def _cached_content(key: str, llm_inputs: Dict[str, Any]) -> Optional[str]:
+    if not TRIP_CACHE_ENABLED:
+        return None
+    with _LLM_CACHE_LOCK:
+        content = _LLM_CACHE.get(key)
+        template = _PLAN_TEMPLATES.get(_template_key(llm_inputs)) if content is None else None
+    if content is not None:
+        log.debug("LLM cache hit")
+    elif template is not None:
+        log.debug("LLM template hit")
+        content = template.replace("{startISO}", llm_inputs["startISO"]).replace("{endISO}", llm_inputs["endISO"])
+    return content
+
+def _plan_and_remember(key: str, content: str, trip: dict, llm_inputs: Dict[str, Any]) -> dict:
+    # Only replies that produced a valid plan are cached
+    data = _plan_from_content(content, trip, llm_inputs)
+    if TRIP_CACHE_ENABLED:
+        start_iso, end_iso = llm_inputs["startISO"], llm_inputs["endISO"]
+        with _LLM_CACHE_LOCK:
+            _LLM_CACHE[key] = content
+            # Same-day trips can't tell the two dates apart, so they aren't templated
+            if start_iso != end_iso:
+                _PLAN_TEMPLATES[_template_key(llm_inputs)] = (
+                    content.replace(start_iso, "{startISO}").replace(end_iso, "{endISO}")
+                )
+    return data
+
+def breakdown_trip_to_queries(trip: dict) -> dict:
+    llm_inputs = _breakdown_inputs(trip)
+    key = _llm_cache_key(llm_inputs)
+    content = _cached_content(key, llm_inputs)
+
+    # 4) Invoke with retry and better error handling
+    if content is None:
+        try:
+            response = invoke_with_retry(breakdown_chain, llm_inputs, attempts=3)
+            content = _response_content(response)
+        except Exception as e:
+            log.warning("Error during LLM invocation: %s", e)
+            raise ValueError(f"LLM invocation failed: {e}")
+
+    return _plan_and_remember(key, content, trip, llm_inputs)
+
+# Async breakdown calls in flight, by cache key: concurrent identical trips await
+# the same Gemini call instead of each sending their own
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+async def _breakdown_content_async(key: str, llm_inputs: Dict[str, Any]) -> str:
+    pending = _INFLIGHT.get(key)
+    if pending is not None:
+        log.debug("Joining in-flight LLM call")
+        return await asyncio.shield(pending)
+
+    fut = asyncio.get_running_loop().create_future()
+    # Followers may never look at a failure; don't warn about it being unretrieved
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _INFLIGHT[key] = fut
+    try:
+        response = await ainvoke_with_retry(breakdown_chain, llm_inputs, attempts=3, hedge_sec=LLM_HEDGE_SEC)
+        content = _response_content(response)
+        fut.set_result(content)
+        return content
+    except Exception as e:
+        log.warning("Error during LLM invocation: %s", e)
+        err = ValueError(f"LLM invocation failed: {e}")
+        fut.set_exception(err)
+        raise err
+    finally:
+        _INFLIGHT.pop(key, None)
+        # Cancelled leader (e.g. client disconnect): hand followers a ValueError so
+        # they take their fallback path instead of being cancelled along with us
+        if not fut.done():
+            fut.set_exception(ValueError("LLM invocation cancelled"))
+
+async def breakdown_trip_to_queries_async(trip: dict) -> dict:
+    llm_inputs = _breakdown_inputs(trip)
+    key = _llm_cache_key(llm_inputs)
+    content = _cached_content(key, llm_inputs)
+
+    if content is None:
+        content = await _breakdown_content_async(key, llm_inputs)
+
+    return _plan_and_remember(key, content, trip, llm_inputs)
+
+def _finish_section(name: str, value: Any, trip: dict, llm_inputs: Dict[str, Any]) -> Any:
+    # Same post-processing _plan_from_content applies, scoped to one section
+    section = force_dates_into_queries({name: value}, llm_inputs["startISO"], llm_inputs["endISO"])
+    if name == "flights":
+        section = ensure_iata_codes_in_flights(section, trip.get("departure", ""), trip.get("destination", ""))
+    return section[name]
+
+def breakdown_trip_to_queries_streaming(trip: dict) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming breakdown_trip_to_queries. Yields (section, queries) for each
+    top-level section as soon as it closes in the model output, so e.g. flight
+    lookups can start early, then ("plan", full_plan) once the reply is validated.
+    No retries: a failed stream raises ValueError like the non-streaming path.
+    """
+    llm_inputs = _breakdown_inputs(trip)
+    key = _llm_cache_key(llm_inputs)
+    content = _cached_content(key, llm_inputs)
+    emitted = set()
+
+    if content is None:
+        buf = ""
+        try:
+            for chunk in breakdown_chain.stream(llm_inputs):
+                buf += chunk.content if hasattr(chunk, "content") else str(chunk)
+                partial = parse_partial_json(buf.strip())
+                if not isinstance(partial, dict):
+                    continue
+                # Every key but the last one seen has been closed by the model
+                for name in list(partial)[:-1]:
+                    if name in PLAN_SECTIONS and name not in emitted:
+                        emitted.add(name)
+                        yield name, _finish_section(name, partial[name], trip, llm_inputs)
+            content = _response_content(buf)
+        except Exception as e:
+            log.warning("Error during LLM invocation: %s", e)
+            raise ValueError(f"LLM invocation failed: {e}")
+
+    data = _plan_and_remember(key, content, trip, llm_inputs)
+    for name in PLAN_SECTIONS:
+        if name not in emitted:
+            yield name, data[name]
+    yield "plan", data
+
+def _fallback_for(trip: dict, err: Exception) -> dict:
+    log.warning("LLM failed, using fallback plan: %s", err)
+    # Parse dates for fallback
+    start_iso = to_iso_date(trip.get("startDate", ""))
+    end_iso = to_iso_date(trip.get("endDate", ""))
+    if not start_iso or not end_iso:
+        raise ValueError(f"Could not parse dates for fallback. startDate='{trip.get('startDate')}', endDate='{trip.get('endDate')}'")
+    return create_fallback_plan(trip, start_iso, end_iso)
+
 def generate_travel_plan(trip: dict) -> dict:
     try:
         return breakdown_trip_to_queries(trip)
     except Exception as e:
-        print(f"[TripPilot] LLM failed, using fallback plan: {e}")
-        # Parse dates for fallback
-        start_iso = to_iso_date(trip.get("startDate", ""))
-        end_iso = to_iso_date(trip.get("endDate", ""))
-        if not start_iso or not end_iso:
-            raise ValueError(f"Could not parse dates for fallback. startDate='{trip.get('startDate')}', endDate='{trip.get('endDate')}'")
-        return create_fallback_plan(trip, start_iso, end_iso)
+        return _fallback_for(trip, e)
+
+async def generate_travel_plan_async(trip: dict) -> dict:
+    async with _llm_semaphore:
+        try:
+            return await breakdown_trip_to_queries_async(trip)
+        except Exception as e:
+            return _fallback_for(trip, e)
+
+async def generate_many(trips: List[dict]) -> List[dict]:
+    """Generate plans for several trips concurrently (LLM calls overlap on I/O)."""
+    return await asyncio.gather(*(generate_travel_plan_async(t) for t in trips))
+
+def generate_travel_plans_batch(trips: List[dict]) -> List[dict]:
+    """
+    Generate plans for several trips with a single breakdown_chain.batch call.
+    Trips whose batched call fails get the usual retries, then the fallback plan.
+    """
+    plans: List[Optional[dict]] = [None] * len(trips)
+    pending = []
+    for i, trip in enumerate(trips):
+        try:
+            llm_inputs = _breakdown_inputs(trip)
+            key = _llm_cache_key(llm_inputs)
+            content = _cached_content(key, llm_inputs)
+            if content is None:
+                pending.append((i, key, llm_inputs))
+            else:
+                plans[i] = _plan_and_remember(key, content, trip, llm_inputs)
+        except Exception as e:
+            plans[i] = _fallback_for(trip, e)
+
+    responses = breakdown_chain.batch(
+        [llm_inputs for _, _, llm_inputs in pending],
+        config={"max_concurrency": LLM_CONCURRENCY},
+        return_exceptions=True,
+    )
+    for (i, key, llm_inputs), response in zip(pending, responses):
+        trip = trips[i]
+        try:
+            if isinstance(response, Exception):
+                log.warning("Batched LLM call failed: %s", response)
+                response = invoke_with_retry(breakdown_chain, llm_inputs, attempts=2)
+            plans[i] = _plan_and_remember(key, _response_content(response), trip, llm_inputs)
+        except Exception as e:
+            plans[i] = _fallback_for(trip, e)
+    return plans
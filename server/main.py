@@ -1,14 +1,48 @@
+import asyncio
+import copy
+import hashlib
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, Depends, HTTPException
+from typing import Optional
+import anyio.to_thread
+import orjson
+from cachetools import TTLCache
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from helpers.extractToken import get_current_user
 from database.pinecone import add_user_pinecone, index
-from helpers.agent import generate_travel_plan, test_llm_connection
-from api.flights import search_best_flight_from_hint
-from api.lodging import search_best_lodging_from_hint_serpapi
+from helpers.agent import generate_travel_plan_async, test_llm_connection
+from api.flights import search_best_flight_from_hint_async
+from api.lodging import search_best_lodging_from_hint_serpapi, search_best_lodging_from_hint_serpapi_async
+from api.serpapi_client import aclose_async_client
 from pydantic import BaseModel
 
-app = FastAPI()
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="[%(name)s] %(levelname)s %(message)s",
+)
+log = logging.getLogger(__name__)
+
+# Plain `def` handlers (Pinecone, SerpAPI and LLM SDK calls) run in Starlette's
+# threadpool; `async def` handlers must not block - await async clients instead.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Warm the Pinecone index's connection pool (TLS + auth) before the first request
+    try:
+        await asyncio.to_thread(index.describe_index_stats)
+    except Exception as e:
+        log.warning("Pinecone warm-up failed: %s", e)
+    yield
+    await aclose_async_client()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 origins = [
     "http://localhost:3000",  # your frontend
     # add more origins if deployed
@@ -22,6 +56,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# First amount in a budget string: "$1,200" -> 1200, "1500.50 USD" -> 1500.5
+BUDGET_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
 class Trip(BaseModel):
     destination: str
     departure: str
@@ -41,7 +78,7 @@ async def read_root():
     return {"message": "Hello, FastAPI"}
 
 @app.get("/test_llm")
-async def test_llm():
+def test_llm():
     """Test endpoint to check if the LLM is working"""
     try:
         success = test_llm_connection()
@@ -57,16 +94,17 @@ def get_me(current_user: dict = Depends(get_current_user)):
         "username": current_user["username"]
     }
 
-@app.post("/register_pinecone_user")
-def register_user_in_pinecone(current_user: dict = Depends(get_current_user)):
+@app.post("/register_pinecone_user", status_code=202)
+def register_user_in_pinecone(background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
     username = current_user["username"]
     
     # You can customize this text to represent the user's profile, preferences, etc.
     default_text = f"This is the profile for {username}"
 
-    add_user_pinecone(user_id=user_id, username=username, text=default_text)
-    return {"message": f"User {username} registered in Pinecone with ID {user_id}"}
+    # Embed + upsert runs after the response is sent, so the client isn't held on Pinecone
+    background_tasks.add_task(add_user_pinecone, user_id=user_id, username=username, text=default_text)
+    return {"status": "queued", "message": f"User {username} queued for Pinecone registration with ID {user_id}"}
 
 # main.py
 @app.get("/test_lodging_serpapi")
@@ -77,79 +115,219 @@ def test_lodging_serpapi():
     )
 
 
+class UserFetchBatcher:
+    """
+    Coalesces concurrent "does this user exist" lookups into one Pinecone
+    index.fetch: ids queued within window_sec (or max_batch of them) share a call.
+    """
+
+    def __init__(self, window_sec: float = 0.01, max_batch: int = 100):
+        self.window_sec = window_sec
+        self.max_batch = max_batch
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def exists(self, user_id: str) -> bool:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((user_id, fut))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        return await fut
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window_sec)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)  # keep a reference until it finishes
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[str, asyncio.Future]]):
+        ids = list({user_id for user_id, _ in batch})
+        try:
+            response = await asyncio.to_thread(index.fetch, ids=ids)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for user_id, fut in batch:
+            if not fut.done():
+                fut.set_result(user_id in response.vectors)
+
+user_fetch_batcher = UserFetchBatcher()
+
 @app.get("/check_user_exists")
-def check_user_exists(current_user: dict = Depends(get_current_user)):
+async def check_user_exists(current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
     try:
-        response = index.fetch(ids=[user_id])
-        exists = user_id in response.vectors
+        exists = await user_fetch_batcher.exists(user_id)
         return {"exists": exists}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+# Recent search results by SHA-256 of their inputs, so resubmitted trips (UI edits,
+# retries) skip SerpAPI; plans are already cached by agent.py. Error results aren't
+# kept, and hits are deep-copied so callers never share a mutable result.
+RESULT_CACHE_TTL_SEC = 3600
+FLIGHT_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=RESULT_CACHE_TTL_SEC)
+LODGING_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=RESULT_CACHE_TTL_SEC)
+# Whole process_trip responses, so a fully resolved trip skips even the per-step lookups
+TRIP_RESULT_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=RESULT_CACHE_TTL_SEC)
+
+def result_cache_key(*parts) -> str:
+    # No OPT_SORT_KEYS: parts are Trip.model_dump() dicts (field order fixed by the
+    # model) and kwargs from fixed call sites, so their key order is already stable
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()
+
+async def cached_search_best_flight(hint: str, **kwargs) -> dict:
+    key = result_cache_key(hint, kwargs)
+    flight = FLIGHT_CACHE.get(key)
+    if flight is not None:
+        return copy.deepcopy(flight)
+    flight = await search_best_flight_from_hint_async(hint, **kwargs)
+    if not flight.get("fallback"):
+        FLIGHT_CACHE[key] = copy.deepcopy(flight)
+    return flight
+
+async def cached_search_best_lodging(hint: str, **kwargs) -> dict:
+    key = result_cache_key(hint, kwargs)
+    lodging = LODGING_CACHE.get(key)
+    if lodging is not None:
+        return copy.deepcopy(lodging)
+    lodging = await search_best_lodging_from_hint_serpapi_async(hint, **kwargs)
+    if lodging.get("ok"):
+        LODGING_CACHE[key] = copy.deepcopy(lodging)
+    return lodging
+
+async def process_trip(i: int, trip: Trip) -> dict:
+    trip_dict = trip.model_dump()
+    log.debug("Trip %d: %s", i + 1, trip_dict)
+    trip_key = result_cache_key(trip_dict)
+    cached = TRIP_RESULT_CACHE.get(trip_key)
+    if cached is not None:
+        log.debug("Trip %d served from cache", i + 1)
+        return copy.deepcopy(cached)
+
+    # Call Gemini LLM to generate a plan
+    log.debug("Generating plan for trip %d...", i + 1)
+    plan = await generate_travel_plan_async(trip_dict)
+    log.debug("Plan generated successfully for trip %d", i + 1)
+    flight_hints = (plan.get("flights") or {}).get("serpapi") or []
+    if not flight_hints:
+        raise HTTPException(status_code=500, detail="LLM did not return a flights.serpapi hint")
+
+    # 3) Convert budget string like "$1200" or "1200 USD" to a float if you want the 1/4 rule
+    m = BUDGET_RE.search(trip_dict.get("budget", ""))
+    total_budget = float(m.group(0).replace(",", "")) if m else None
+
+    # 4) Hit SerpAPI & pick best flight, and the best lodging alongside it
+    searches = [
+        cached_search_best_flight(
+            flight_hints[0],
+            total_budget_usd=total_budget,
+            currency="USD",  # or detect from user
+            gl="ca",
+            hl="en",
+        )
+    ]
+    lodging_hints = (plan.get("lodging") or {}).get("Expedia") or []
+    if lodging_hints:
+        searches.append(cached_search_best_lodging(lodging_hints[0], gl="ca", hl="en"))
+    best_flight, *rest = await asyncio.gather(*searches)
+    best_lodging = rest[0] if rest else None
+
+    log.debug("Generated plan for trip %d: %s", i + 1, plan)
+    result = {
+        "trip": trip_dict,
+        "plan": plan,
+        "flight": best_flight,  # <- your UI can show price, legs, duration, etc.
+        "lodging": best_lodging,
+    }
+    # Replay only fully resolved trips; any fallback reruns the pipeline next time
+    if (
+        not plan.get("_meta", {}).get("fallback")
+        and not best_flight.get("fallback")
+        and (best_lodging is None or best_lodging.get("ok"))
+    ):
+        TRIP_RESULT_CACHE[trip_key] = copy.deepcopy(result)
+    return result
+
+# Each trip costs a Gemini call plus SerpAPI searches; bound a single request
+MAX_TRIPS_PER_REQUEST = int(os.getenv("MAX_TRIPS_PER_REQUEST", "20"))
+
+def check_trip_count(payload: TripList):
+    if not payload.trips:
+        raise HTTPException(status_code=400, detail="No trips provided")
+    if len(payload.trips) > MAX_TRIPS_PER_REQUEST:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many trips ({len(payload.trips)}); submit at most {MAX_TRIPS_PER_REQUEST} per request",
+        )
+
 @app.post("/create_trip")
-def create_trip(payload: TripList, current_user: dict = Depends(get_current_user)):
+async def create_trip(payload: TripList, current_user: dict = Depends(get_current_user)):
     user_id = current_user["user_id"]
     
-    if not payload.trips:
-        raise HTTPException(status_code=400, detail="No trips provided")
+    check_trip_count(payload)
 
     try:
-        trip_plans = []
-        print(f"Received {len(payload.trips)} trip(s) from user {user_id}")
-        for i, trip in enumerate(payload.trips):
-            trip_dict = trip.dict()
-            print(f"Trip {i+1}: {trip_dict}")
-
-            # Call Gemini LLM to generate a plan
-            print(f"[create_trip] Generating plan for trip {i+1}...")
-            plan = generate_travel_plan(trip_dict)
-            print(f"[create_trip] Plan generated successfully for trip {i+1}")
-            flight_hints = (
-                plan.get("flights", {})
-                    .get("serpapi", [])
-                or plan.get("flights", {}).get("serpapi", [])  # fallback if needed
-            )
-            if not flight_hints:
-                raise HTTPException(status_code=500, detail="LLM did not return a flights.serpapi hint")
-
-            # 3) Convert budget string like "$1200" or "1200 USD" to a float if you want the 1/4 rule
-            total_budget = None
-            try:
-                # very light parse
-                digits = "".join(ch for ch in trip_dict.get("budget", "") if ch.isdigit())
-                if digits:
-                    total_budget = float(digits)
-            except Exception:
-                pass
-
-            # 4) Hit SerpAPI & pick best flight
-            best_flight = search_best_flight_from_hint(
-                flight_hints[0],
-                total_budget_usd=total_budget,
-                currency="USD",  # or detect from user
-                gl="ca",
-                hl="en",
-            )
-
-            lodging_hints = plan.get("lodging", {}).get("Expedia", [])
-            best_lodging = None
-            if lodging_hints:
-                best_lodging = search_best_lodging_from_hint_serpapi(lodging_hints[0], gl="ca", hl="en")
-
-            trip_plans.append({
-                "trip": trip_dict,
-                "plan": plan,
-                "flight": best_flight,  # <- your UI can show price, legs, duration, etc.
-                "lodging": best_lodging,
-            })
-            print(f"Generated plan for trip {i+1}: {plan}")
+        log.info("Received %d trip(s) from user %s", len(payload.trips), user_id)
+        # Trips are independent: plan and search all of them concurrently
+        trip_plans = await asyncio.gather(*(process_trip(i, trip) for i, trip in enumerate(payload.trips)))
 
         return {"message": "Trips processed successfully", "plans": trip_plans}
     except Exception as e:
-        import traceback
-        print("[create_trip] EXCEPTION:", repr(e))
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        log.exception("create_trip failed: %r", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/create_trip/stream")
+async def create_trip_stream(payload: TripList, current_user: dict = Depends(get_current_user)):
+    """
+    Streaming create_trip: one NDJSON line per trip as soon as it finishes, in
+    completion order ("index" is the trip's position in the request), so the UI
+    can render the first plan without waiting for the slowest one.
+    """
+    user_id = current_user["user_id"]
+
+    check_trip_count(payload)
+
+    log.info("Received %d trip(s) from user %s (streaming)", len(payload.trips), user_id)
+
+    async def run(i: int, trip: Trip) -> dict:
+        try:
+            return {"index": i, **await process_trip(i, trip)}
+        except Exception as e:
+            log.warning("Trip %d failed: %r", i + 1, e)
+            return {"index": i, "error": str(e)}
+
+    async def lines():
+        for next_done in asyncio.as_completed([run(i, trip) for i, trip in enumerate(payload.trips)]):
+            yield orjson.dumps(await next_done) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # `python main.py`: one worker per CPU unless WEB_CONCURRENCY is set; loop="auto"
+    # picks uvloop when it is installed. The plan/flight/lodging TTLCaches are per
+    # worker, while the SerpAPI response cache is a SQLite file shared by all of them.
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",
+        http="httptools",
+        backlog=2048,
+    )